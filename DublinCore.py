@@ -1,11 +1,185 @@
+import re
 import xml.sax.saxutils
+from urllib import quote
 from dublincore import dublinCoreMetadata
 
+# element attributes in the order they are written, with their dc: tags
+ELEMENTS = (('Title', 'title'), ('Creator', 'creator'), ('Subject', 'subject'),
+	('Description', 'description'), ('Publisher', 'publisher'),
+	('Contributor', 'contributor'), ('Date', 'date'), ('Type', 'type'),
+	('Format', 'format'), ('Identifier', 'identifier'), ('Source', 'source'),
+	('Language', 'language'), ('Relation', 'relation'),
+	('Coverage', 'coverage'), ('Rights', 'rights'))
+
+# (attribute, opening tag, closing tag) of every element, for makeXML and makeRDF
+XML_TAGS = tuple((attribute, '\t<dc:%s>' % tag, '</dc:%s>\n' % tag) for attribute, tag in ELEMENTS)
+RDF_TAGS = tuple((attribute, '\t' + opening, closing) for attribute, opening, closing in XML_TAGS)
+
+# the start of every makeRDF document: the XML declaration, the DTD and the
+# opening rdf:RDF tag, and its end; the rdf:Description elements of one or
+# more records go between them
+RDF_HEAD = ('<?xml version="1.0"?>\n'
+	'<!DOCTYPE rdf:RDF PUBLIC "-//DUBLIN CORE//DCMES DTD 2002/07/31//EN" "http://dublincore.org/documents/2002/07/31/dcmes-xml/dcmes-xml-dtd.dtd">\n'
+	'\t<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns:dc="http://purl.org/dc/elements/1.1/">\n')
+RDF_TAIL = '</rdf:RDF>\n'
+
+# (attribute, full predicate IRI, Turtle name) of every element, for
+# makeNTriples and makeTurtle
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+TRIPLE_PREDICATES = tuple((attribute, '<%s%s>' % (DC_NS, tag), 'dc:' + tag) for attribute, tag in ELEMENTS)
+TURTLE_HEAD = '@prefix dc: <%s> .\n\n' % DC_NS
+
+# makeXML headers by (schemaLocation, encapsulatingTag)
+_xmlheads = {}
+
+def xmlhead(schemaLocation, encapsulatingTag='metadata'):
+	"""
+	The XML declaration and opening tag with its namespace and schema
+	declarations that start a makeXML document, built once for each
+	schema location
+	"""
+	key = (schemaLocation, encapsulatingTag)
+	if key not in _xmlheads:
+		_xmlheads[key] = '''<?xml version="1.0"?>\n\n<%s
+    xmlns="http://example.org/myapp/"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="%s"
+    xmlns:dc="http://purl.org/dc/elements/1.1/">\n\n''' % (encapsulatingTag, schemaLocation)
+	return _xmlheads[key]
+
+# what escapeattribute() turns into references besides &, < and >
+ATTRIBUTE_ENTITIES = {'"': '&quot;', '\t': '&#9;', '\n': '&#10;', '\r': '&#13;'}
+# the characters escapeattribute() changes
+ATTRIBUTE_SPECIAL = re.compile('[&<>"\x00-\x1f]')
+# the control characters XML 1.0 does not allow anywhere
+CONTROLS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def clean(text):
+	"""
+	Does text hold none of the characters xml.sax.saxutils.escape
+	replaces? Three C level searches, far cheaper than escaping.
+	"""
+	return '&' not in text and '<' not in text and '>' not in text
+
+def escapeattribute(value):
+	"""
+	Escape a value for a double quoted attribute: markup characters and
+	quotes become entities, tabs and line breaks character references so
+	that attribute value normalisation keeps them, and other control
+	characters, which XML cannot hold, are dropped
+	"""
+	if not ATTRIBUTE_SPECIAL.search(value):
+		return value
+	return CONTROLS.sub('', xml.sax.saxutils.escape(value, ATTRIBUTE_ENTITIES))
+
+# what ntescape() writes for the characters N-Triples strings cannot hold
+# as they are, other control characters become \u escapes
+NT_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+NT_SPECIAL = re.compile('[\\\\"\x00-\x1f\x7f]')
+# the characters iri() keeps, every printable ASCII character an IRI
+# reference may hold
+IRI_SAFE = "!#$%&'()*+,-./:;=?@[]_~"
+
+def ntescape(value):
+	"""
+	Escape a value for a quoted N-Triples or Turtle string: backslashes,
+	quotes and control characters become escape sequences
+	"""
+	if not NT_SPECIAL.search(value):
+		return value
+	return NT_SPECIAL.sub(lambda match: NT_ESCAPES.get(match.group()) or '\\u%04X' % ord(match.group()), value)
+
+def iri(value):
+	""" %-encode the characters of value an N-Triples IRI cannot hold """
+	return quote(value, IRI_SAFE)
+
+def tripleobject(attribute, value):
+	""" The object of the triple of a value, a source which is a URL becomes an IRI """
+	if attribute == 'Source' and value.startswith('http://'):
+		return '<%s>' % iri(value)
+	return '"%s"' % ntescape(value)
+
+# values longer than this are escaped a piece at a time by iterXML
+CHUNK_SIZE = 1 << 16
+
+def escapechunks(value, escape=xml.sax.saxutils.escape, size=CHUNK_SIZE):
+	"""
+	Escape a long value a chunk at a time; escaping replaces single
+	characters, so the value can be cut anywhere
+	"""
+	for start in xrange(0, len(value), size):
+		yield escape(value[start:start + size])
+
+def values(value):
+	"""
+	The values of an element: every entry of a list, including empty ones,
+	or a string on its own if it is not empty
+	"""
+	if isinstance(value, list):
+		return value
+	return [value] if value else []
+
 class DublinCore(dublinCoreMetadata):
+	# escapes element text, may be replaced to share escaped values
+	escape = staticmethod(xml.sax.saxutils.escape)
+
 	def __init__(self):
 		dublinCoreMetadata.__init__(self)
 		self.Relation = []
 	
+	def makeRDF(self):
+		"""
+		This method transforms the class attribute data into standards
+		compliant RDF according to the guidlines laid out in "Expressing Simple 
+		Dublin Core in RDF/XML" available online at
+		http://www.dublincore.org/documents/2002/07/31/dcmes-xml/
+		
+		Unlike dublinCoreMetadata.makeRDF, any element may be a list with
+		one tag written per entry, and the rdf:Description element is
+		always opened.
+		
+		This method is passed no arguments and returns a string. The output can
+		be directed to a file or standard output. This RDF data should be 
+		suitable for marking most documents including webpages.
+		"""
+		#if the about element is set (reccomended) include it properly
+		if self.about and self.about.startswith('http://'):
+			description = self.rdfDescription(self.about)
+		else:
+			description = self.rdfDescription()
+
+		return ''.join((RDF_HEAD, description, RDF_TAIL))
+
+	def rdfDescription(self, about=''):
+		"""
+		The rdf:Description element of the record on its own, as makeRDF
+		writes it, for documents that describe many records under one
+		RDF_HEAD and RDF_TAIL. about, if given, is written as the
+		rdf:about attribute. Empty values are left out, as they say
+		nothing about the resource.
+		"""
+		if about:
+			rdfOut = ['\t<rdf:Description rdf:about="%s">\n' % escapeattribute(about)]
+		else:
+			rdfOut = ['\t<rdf:Description>\n']
+
+		#make a tag for every non-empty value of every element, a source
+		#which is a URL becomes a resource; values are only escaped when
+		#the record holds markup characters at all
+		escape = self.escape
+		elements = [(attribute, opening, value, closing) for attribute, opening, closing in RDF_TAGS
+			for value in values(getattr(self, attribute)) if value]
+		dirty = not clean(''.join([element[2] for element in elements]))
+		for attribute, opening, value, closing in elements:
+			if attribute == 'Source' and value.startswith("http://"):
+				rdfOut.append('\t\t<dc:source rdf:resource="%s"/>\n' % escapeattribute(value))
+			else:
+				rdfOut += (opening, escape(value) if dirty and not clean(value) else value, closing)
+
+		rdfOut.append('\t</rdf:Description>\n')
+
+		return ''.join(rdfOut)
+
 	def makeXML(self, schemaLocation, encapsulatingTag='metadata'):
 		"""
 		This method transforms the class attribute data into standards
@@ -20,81 +194,117 @@ class DublinCore(dublinCoreMetadata):
 		DC elements. The default is "metadata" but it can be overridden if
 		needed.
 		
+		Any element may be a list of values, with one tag written for each.
+		The document is put together from precomputed pieces and the tags
+		of xmlElements.
+		
 		The output can be directed to a file or standard output. This RDF 
 		data should be suitable for marking most documents including webpages.
 		"""
-		#set XML declaration
-		xmlOut = '<?xml version="1.0"?>\n'
-		
-		#open encapsulating element tag and deal with namespace and schema declarations
-		xmlOut += '''\n<%s
-    xmlns="http://example.org/myapp/"
-    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-    xsi:schemaLocation="%s"
-    xmlns:dc="http://purl.org/dc/elements/1.1/">\n\n''' % (encapsulatingTag, schemaLocation)
-		
-		#if the Title element is set, make the dc:title tag
-		if self.Title:
-			xmlOut += '\t<dc:title>%s</dc:title>\n' % xml.sax.saxutils.escape(self.Title)
-		
-		#if the creator element is set, make the dc:title tag
-		if self.Creator:
-			xmlOut += '\t<dc:creator>%s</dc:creator>\n' % xml.sax.saxutils.escape(self.Creator)
-		
-		#if the subject element is set, make the dc:subject tag
-		if self.Subject:
-			xmlOut += '\t<dc:subject>%s</dc:subject>\n' % xml.sax.saxutils.escape(self.Subject)
-		
-		#if the description element is set, make the dc:description tag
-		if self.Description:
-			xmlOut += '\t<dc:description>%s</dc:description>\n' % xml.sax.saxutils.escape(self.Description)
-			
-		#if the publisher element is set, make the dc:publisher tag
-		if self.Publisher:
-			xmlOut += '\t<dc:publisher>%s</dc:publisher>\n' % xml.sax.saxutils.escape(self.Publisher)
-			
-		#if the contributor element is set, make the dc:contributor tag
-		if self.Contributor:
-			xmlOut += '\t<dc:contributor>%s</dc:contributor>\n' % xml.sax.saxutils.escape(self.Contributor)
-			
-		#if the date element is set, make the dc:date tag
-		if self.Date:
-			xmlOut += '\t<dc:date>%s</dc:date>\n' % xml.sax.saxutils.escape(self.Date)
-			 
-		#if the type element is set, make the dc:type tag
-		if self.Type:
-			xmlOut += '\t<dc:type>%s</dc:type>\n' % xml.sax.saxutils.escape(self.Type)
-			
-		#if the format element is set, make the dc:format tag
-		if self.Format:
-			xmlOut += '\t<dc:format>%s</dc:format>\n' % xml.sax.saxutils.escape(self.Format)
-		
-		#if the identifier element is set, make the dc:identifier tag
-		if self.Identifier:
-			xmlOut += '\t<dc:identifier>%s</dc:identifier>\n' % xml.sax.saxutils.escape(self.Identifier)
-			
-		#if the source element is set, deal with it properly
-		if self.Source:
-			xmlOut += '\t<dc:source>%s</dc:source>\n' % xml.sax.saxutils.escape(self.Source)
+		return ''.join((xmlhead(schemaLocation, encapsulatingTag), self.xmlElements(), '</metadata>\n'))
+
+	def xmlElements(self, empty=True):
+		"""
+		The dc tags of makeXML on their own, for documents which wrap the
+		elements of a record in something else. Without empty, empty list
+		entries are left out rather than written as empty tags.
+		"""
+		xmlOut = []
 		
-		#if the language element is set, make the dc:language tag
-		if self.Language:
-			xmlOut += '\t<dc:language>%s</dc:language>\n' % xml.sax.saxutils.escape(self.Language)
-			
-		#if the relation element is set, make the dc:relation tag
-		if self.Relation:
-			for relation in self.Relation:
-				xmlOut += '\t<dc:relation>%s</dc:relation>\n' % xml.sax.saxutils.escape(relation)
-			
-		#if the coverage element is set, make the dc:coverage tag
-		if self.Coverage:
-			xmlOut += '\t<dc:coverage>%s</dc:coverage>\n' % xml.sax.saxutils.escape(self.Coverage)
-			
-		#if the rights element is set, make the dc:rights tag
-		if self.Rights:
-			xmlOut += '\t<dc:rights>%s</dc:rights>\n' % xml.sax.saxutils.escape(self.Rights)
-			
-		#close encapsulating element tag
-		xmlOut += '</metadata>\n'
+		#make a dc tag for every value of every element that is set, only
+		#escaping values when the record holds markup characters at all
+		escape = self.escape
+		elements = [(opening, value, closing) for attribute, opening, closing in XML_TAGS
+			for value in values(getattr(self, attribute)) if value or empty]
+		dirty = not clean(''.join([element[1] for element in elements]))
+		for opening, value, closing in elements:
+			xmlOut += (opening, escape(value) if dirty and not clean(value) else value, closing)
 		
-		return xmlOut
\ No newline at end of file
+		return ''.join(xmlOut)
+	
+	def iterXML(self, schemaLocation, encapsulatingTag='metadata'):
+		"""
+		The output of makeXML a piece at a time, for writing a record to a
+		file without holding the document in memory. Values longer than
+		CHUNK_SIZE are escaped and yielded a chunk at a time.
+		"""
+		yield xmlhead(schemaLocation, encapsulatingTag)
+		escape = self.escape
+		for attribute, opening, closing in XML_TAGS:
+			for value in values(getattr(self, attribute)):
+				yield opening
+				if len(value) > CHUNK_SIZE:
+					for chunk in escapechunks(value):
+						yield chunk
+				else:
+					yield value if clean(value) else escape(value)
+				yield closing
+		yield '</metadata>\n'
+	
+	def writeXML(self, fp, schemaLocation, encapsulatingTag='metadata'):
+		"""
+		Write the output of makeXML to the open file fp as it is produced,
+		see iterXML
+		"""
+		fp.writelines(self.iterXML(schemaLocation, encapsulatingTag))
+
+	def makeNTriples(self, subject):
+		"""
+		The record as N-Triples, one line for every non-empty value of every
+		element. subject is an IRI in angle brackets or a blank node label.
+		As in makeRDF a source which is a URL becomes an IRI.
+		"""
+		return ''.join(['%s %s %s .\n' % (subject, predicate, tripleobject(attribute, value))
+			for attribute, predicate, name in TRIPLE_PREDICATES
+			for value in values(getattr(self, attribute)) if value])
+
+	def makeTurtle(self, subject):
+		"""
+		The triples of makeNTriples as one Turtle statement using the dc:
+		prefix of TURTLE_HEAD, or nothing if every value is empty
+		"""
+		objects = ['%s %s' % (name, tripleobject(attribute, value))
+			for attribute, predicate, name in TRIPLE_PREDICATES
+			for value in values(getattr(self, attribute)) if value]
+		if not objects:
+			return ''
+		return '%s %s .\n\n' % (subject, ' ;\n\t'.join(objects))
+
+class DublinCoreRecord(object):
+	"""
+	A compact Dublin Core record with the same elements and output methods
+	as DublinCore. The elements live in slots rather than a per-instance
+	dictionary, which makes each record several times smaller when many
+	of them are held in memory at once.
+	"""
+	__slots__ = ('Title', 'Creator', 'Subject', 'Description', 'Publisher',
+		'Contributor', 'Date', 'Type', 'Format', 'Identifier', 'Source',
+		'Language', 'Relation', 'Coverage', 'Rights', 'about')
+
+	def __init__(self):
+		self.Title = ""
+		self.Creator = ""
+		self.Subject = ""
+		self.Description = ""
+		self.Publisher = ""
+		self.Contributor = ""
+		self.Date = ""
+		self.Type = ""
+		self.Format = ""
+		self.Identifier = ""
+		self.Source = ""
+		self.Language = ""
+		self.Relation = []
+		self.Coverage = ""
+		self.Rights = ""
+		self.about = ""
+
+	escape = staticmethod(xml.sax.saxutils.escape)
+	makeRDF = DublinCore.makeRDF.im_func
+	rdfDescription = DublinCore.rdfDescription.im_func
+	makeXML = DublinCore.makeXML.im_func
+	xmlElements = DublinCore.xmlElements.im_func
+	iterXML = DublinCore.iterXML.im_func
+	writeXML = DublinCore.writeXML.im_func
+	makeNTriples = DublinCore.makeNTriples.im_func
+	makeTurtle = DublinCore.makeTurtle.im_func
@@ -0,0 +1,6 @@
+import imp
+import os.path
+
+# tsv-convert.py is a script, its name is not importable
+tsvconvert = imp.load_source('tsvconvert', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+	'tsv-convert.py'))
@@ -0,0 +1,60 @@
+import random
+import unittest
+
+from DublinCore import ELEMENTS
+from test import tsvconvert
+
+COLUMNS = ['c{0}'.format(i) for i in range(8)]
+ELEMENT_NAMES = [attribute for attribute, tag in ELEMENTS] + ['macrepo:oldNid', 'macrepo:notes', 'macrepo:scale']
+DELIMITERS = [None, None, ';', '|']
+DEFAULTS = ['', '', 'x', 'Arts & Sciences', 'A "b" <c>', 'p;q', 'a|b&c']
+CELLS = ['', '', 'plain', 'caf\xc3\xa9', 'x<y', 'A&B', 'z>w', '"quoted"', 'a;b', 'c|d', 'e;f&g', ';', '|<|']
+
+class Collect(object):
+	""" A stream sink keeping the documents it is given """
+	def __init__(self):
+		self.documents = []
+
+	def write(self, fn, text):
+		self.documents.append(text)
+
+def randommapping(rng):
+	""" A mapping of random columns to distinct elements with random delimiters and defaults """
+	mapping = []
+	for element in rng.sample(ELEMENT_NAMES, rng.randint(1, len(ELEMENT_NAMES))):
+		delimiter = None if element == 'Identifier' else rng.choice(DELIMITERS)
+		mapping.append((rng.choice(COLUMNS), element, delimiter, rng.choice(DEFAULTS)))
+	return tuple(mapping)
+
+def expected(plan, row):
+	""" The documents of a row as the record and buildxml() write them """
+	record, macrepo = plan.build(row)
+	return record.makeXML(tsvconvert.DC_NS), tsvconvert.buildxml(macrepo, plan.macrepo, plan.style)
+
+class EmitTest(unittest.TestCase):
+	def test_random_mappings(self):
+		""" emit() and the columnar engine write what build() does for any mapping """
+		rng = random.Random(21)
+		for i in range(3000):
+			mapping = randommapping(rng)
+			fields = rng.sample(COLUMNS, rng.randint(1, len(COLUMNS)))
+			style = rng.choice(sorted(tsvconvert.MACREPO_STYLES))
+			plan = tsvconvert.RowPlan(fields, mapping, style=style)
+			rows = [[rng.choice(CELLS) for field in fields] for n in range(3)]
+			documents = []
+			for row in rows:
+				documents.extend(expected(plan, row))
+				self.assertEqual(plan.emit(row), expected(plan, row), (mapping, fields, row))
+			sink = Collect()
+			tsvconvert.writecolumns(rows, plan, sink)
+			self.assertEqual(sink.documents, documents, (mapping, fields, rows))
+
+	def test_escaped_default(self):
+		""" A default with markup is escaped in a clean row """
+		mapping = (('dc:identifier', 'Identifier', None, ''), ('dc:subject', 'Subject', ';', 'Arts & Sciences'))
+		plan = tsvconvert.RowPlan(['dc:identifier', 'dc:subject'], mapping)
+		dc, macrepo = plan.emit(['r1', ''])
+		self.assertTrue('<dc:subject>Arts &amp; Sciences</dc:subject>' in dc)
+
+if __name__ == '__main__':
+	unittest.main()
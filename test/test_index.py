@@ -0,0 +1,36 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from test import tsvconvert
+
+class Collect(object):
+	""" A stream sink keeping the documents it is given by name """
+	def __init__(self):
+		self.documents = {}
+
+	def write(self, fn, text):
+		self.documents[fn] = text
+
+class IndexTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.fn = os.path.join(self.dir, 'input.tsv')
+		fp = open(self.fn, 'w')
+		fp.write('dc:identifier\tdc:description\nm0\tplain\nm1\t"two\nlines"\nm2\tx\n')
+		fp.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_quoted_newlines(self):
+		""" The index spans every line of a row with a quoted newline """
+		tsvconvert.batch([self.fn], quiet=True, sink=Collect(), index=True)
+		sink = Collect()
+		self.assertEqual(tsvconvert.regenerate([self.fn], ['m1', 'm2'], quiet=True, sink=sink), 2)
+		self.assertEqual(sorted(sink.documents), ['m1-DC.xml', 'm1-macrepo.xml', 'm2-DC.xml', 'm2-macrepo.xml'])
+		self.assertTrue('<dc:description>two\nlines</dc:description>' in sink.documents['m1-DC.xml'])
+
+if __name__ == '__main__':
+	unittest.main()
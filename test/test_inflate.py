@@ -0,0 +1,54 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from test import tsvconvert
+
+class Collect(object):
+	""" A stream sink dropping the documents it is given """
+	def write(self, fn, text):
+		pass
+
+class InflateTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def compressed(self, rows):
+		fn = os.path.join(self.dir, 'input.tsv.gz')
+		fp = gzip.open(fn, 'wb')
+		fp.write('dc:identifier\tdc:title\n')
+		fp.writelines(rows)
+		fp.close()
+		return fn
+
+	def test_rows(self):
+		fn = self.compressed(['r{0}\tTitle {0}\n'.format(i) for i in range(50000)])
+		count = tsvconvert.convertfile(fn, Collect(), batch=1000)[0]
+		self.assertEqual(count, 50000)
+
+	def test_stopped_on_error(self):
+		""" A decoding error stops and joins the decompression thread """
+		# random titles compress badly, so the thread is still reading
+		rows = ['r{0}\t{1}\n'.format(i, os.urandom(48).encode('hex')) for i in range(100000)]
+		rows.insert(10, 'bad\xff\tx\n')
+		fn = self.compressed(rows)
+		threads = threading.active_count()
+		self.assertRaises(tsvconvert.DecodeError, tsvconvert.convertfile, fn, Collect(), encoding='utf-8')
+		self.assertEqual(threading.active_count(), threads)
+
+	def test_truncated(self):
+		""" A compressed file cut short is an error, not a shorter conversion """
+		fn = self.compressed(['r{0}\tTitle {0}\n'.format(i) for i in range(1000)])
+		data = open(fn, 'rb').read()
+		for cut in (len(data) // 2, len(data) - 4):
+			open(fn, 'wb').write(data[:cut])
+			self.assertRaises(tsvconvert.DecodeError, tsvconvert.convertfile, fn, Collect())
+
+if __name__ == '__main__':
+	unittest.main()
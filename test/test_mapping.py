@@ -0,0 +1,28 @@
+import os
+import tempfile
+import unittest
+
+from test import tsvconvert
+
+class LoadMappingTest(unittest.TestCase):
+	def load(self, text):
+		fd, fn = tempfile.mkstemp()
+		os.write(fd, text)
+		os.close(fd)
+		try:
+			return tsvconvert.loadmapping(fn)
+		finally:
+			os.remove(fn)
+
+	def test_mapping(self):
+		mapping = self.load('# column\telement\ndc:identifier\tIdentifier\ndc:title\tTitle\t\tUntitled\n'
+			'dc:relation\tRelation\t|\n')
+		self.assertEqual(mapping, (('dc:identifier', 'Identifier', None, ''), ('dc:title', 'Title', None, 'Untitled'),
+			('dc:relation', 'Relation', '|', '')))
+
+	def test_duplicate_element(self):
+		""" An element filled by two columns is rejected """
+		self.assertRaises(ValueError, self.load, 'dc:title\tTitle\nalt_title\tTitle\n')
+
+if __name__ == '__main__':
+	unittest.main()
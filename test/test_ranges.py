@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from test import tsvconvert
+
+class Collect(object):
+	""" A stream sink keeping the names of the documents it is given """
+	def __init__(self):
+		self.names = []
+
+	def write(self, fn, text):
+		self.names.append(fn)
+
+	def writelines(self, fn, pieces):
+		self.names.append(fn)
+
+class RangeTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.fn = os.path.join(self.dir, 'input.tsv')
+		fp = open(self.fn, 'w')
+		fp.write('dc:identifier\tdc:description\n')
+		fp.writelines('r{0}\t"line one\nline two {0}"\n'.format(i) for i in range(2000))
+		fp.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def test_quoted_newlines(self):
+		""" Worker ranges end on record ends, not on newlines inside quoted cells """
+		serial = Collect()
+		tsvconvert.convertfile(self.fn, serial)
+		jobs = tsvconvert.schedule([self.fn], 4)
+		self.assertTrue(len(jobs) > 1)
+		ranged = Collect()
+		for job in jobs:
+			tsvconvert.convertrange(job, ranged)
+		self.assertEqual(sorted(ranged.names), sorted(serial.names))
+		self.assertEqual(len(serial.names), 4000)
+
+	def test_range_shards(self):
+		""" Range shards of rows with quoted newlines add up to a serial run """
+		serial = Collect()
+		tsvconvert.convertfile(self.fn, serial)
+		sharded = Collect()
+		for index in range(7):
+			select = tsvconvert.Selection(shard=(index, 7))
+			for job in tsvconvert.schedule([self.fn], 1, select):
+				tsvconvert.convertrange(job, sharded)
+		self.assertEqual(sharded.names, serial.names)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -4,94 +4,1905 @@
 # Matt McCollow <mccollo@mcmaster.ca>, 2011
 # Nick Ruest <ruestn@mcmaster.ca>, 2011
 
-from DublinCore import DublinCore
+from DublinCore import DublinCore, DublinCoreRecord, ELEMENTS, RDF_HEAD, RDF_TAIL, TURTLE_HEAD, clean, escapechunks, \
+	xmlhead
+import bz2
+import codecs
 import csv
-from sys import argv
-from xml.dom.minidom import Document
+import heapq
+import json
+import mmap
+import os
+import signal
+import sys
+import tarfile
+import zlib
+from collections import namedtuple
+from glob import glob
+from itertools import chain, imap, islice
+from operator import itemgetter
+from multiprocessing import Pool
+from Queue import Empty, Queue
+from StringIO import StringIO
+from tempfile import SpooledTemporaryFile
+from threading import Event, Thread
+from time import gmtime, strftime, time
+from urllib import quote
+from urlparse import urlsplit
+from types import FunctionType
+from optparse import OptionParser
+from xml.sax.saxutils import escape
 from os.path import basename
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
 
 DC_NS = 'http://purl.org/dc/elements/1.1/'
 XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
 MACREPO_NS = 'http://repository.mcmaster.ca/schema/macrepo/elements/1.0/'
 
+# TSV columns read into a DublinCore object, in the order makedc() sets them
+DC_COLUMNS = ('dc:contributor', 'dc:coverage', 'dc:creator', 'dc:date',
+	'dc:description', 'dc:format', 'dc:identifier', 'dc:language',
+	'dc:publisher', 'dc:relation', 'dc:rights', 'dc:source', 'dc:subject',
+	'dc:title')
+# TSV columns written to the macrepo XML, in document order
+MACREPO_COLUMNS = ('macrepo:oldNid', 'macrepo:notes', 'macrepo:scale')
+
+# default column mapping: (TSV column, element, delimiter, default), where
+# element is a DublinCoreRecord attribute or a macrepo element name
+MAPPING = (
+	('dc:contributor', 'Contributor', None, ''),
+	('dc:coverage', 'Coverage', None, ''),
+	('dc:creator', 'Creator', None, ''),
+	('dc:date', 'Date', None, ''),
+	('dc:description', 'Description', None, ''),
+	('dc:format', 'Format', None, ''),
+	('dc:identifier', 'Identifier', None, ''),
+	('dc:language', 'Language', None, ''),
+	('dc:publisher', 'Publisher', None, ''),
+	('dc:relation', 'Relation', '|', ''),
+	('dc:rights', 'Rights', None, ''),
+	('dc:source', 'Source', None, ''),
+	('dc:subject', 'Subject', None, ''),
+	('dc:title', 'Title', None, ''),
+	('macrepo:oldNid', 'macrepo:oldNid', None, ''),
+	('macrepo:notes', 'macrepo:notes', None, ''),
+	('macrepo:scale', 'macrepo:scale', None, ''),
+)
+
+# leading bytes of the compressed formats accepted in place of a plain TSV
+MAGIC = (('\x1f\x8b', 'gzip'), ('BZh', 'bz2'), ('\xfd7zXZ\x00', 'xz'))
+# file names picked up when a directory is given on the command line
+TSV_SUFFIXES = ('.tsv', '.tsv.gz', '.tsv.bz2', '.tsv.xz')
+# upper bound on the byte range handed to a worker in one job
+CHUNK_SIZE = 32 << 20
+# read size for streamed and compressed input
+BLOCK_SIZE = 1 << 20
+# bytes of a plain file a FileMap keeps mapped at once
+WINDOW_SIZE = 8 << 20
+# appended to a TSV file name to name its row index
+INDEX_SUFFIX = '.idx'
+# distinct values whose escaped XML is kept by the EscapeCache
+ESCAPE_CACHE = 4096
+# longest value the EscapeCache keeps, longer ones are escaped each time
+ESCAPE_VALUE = 1 << 10
+# rows converted a column at a time by the columnar engine
+BATCH_SIZE = 1000
+# cell bytes after which a block goes to the columnar engine early
+BATCH_BYTES = 4 << 20
+# rows holding a cell longer than this leave the columnar engine for the
+# streaming writer, which escapes such cells a piece at a time
+STREAM_SIZE = 1 << 16
+# documents a TarSink keeps in memory while measuring them, larger ones
+# are spooled to a temporary file
+SPOOL_SIZE = 1 << 20
+# characters of an identifier kept as they are in an rdf:about URI, the
+# reserved and unreserved characters of RFC 3986; the rest are %-encoded
+URI_SAFE = ":/?#[]@!$&'()*+,;=-._~"
+# default --part-size in megabytes
+PART_SIZE = 100
+# records on an OAI-PMH page unless --part-records says otherwise
+OAI_PAGE = 100
+# characters of an identifier kept as they are in an OAI identifier
+OAI_SAFE = "-_.!~*'();/?:@&=+$,"
+# the start of every OAI-PMH page, given the response date, the verb, the
+# request attributes and the repository url
+OAI_HEAD = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+	'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+	' xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd">\n'
+	'<responseDate>{0}</responseDate>\n'
+	'<request verb="{1}" {2}>{3}</request>\n')
+# the header of a record, given its identifier and datestamp
+OAI_HEADER = '<header>\n<identifier>{0}</identifier>\n<datestamp>{1}</datestamp>\n</header>\n'
+# the opening tag of the oai_dc metadata of a record
+OAI_DC_HEAD = ('<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" xmlns:dc="{0}"'
+	' xmlns:xsi="{1}" xsi:schemaLocation="http://www.openarchives.org/OAI/2.0/oai_dc/'
+	' http://www.openarchives.org/OAI/2.0/oai_dc.xsd">\n').format(DC_NS, XSI_NS)
+# distinct values a column may have before --intern stops pooling it
+POOL_LIMIT = 256
+
+# the layout of a document: the XML declaration and opening tag, the opening
+# and closing tag of an element as format strings, the closing tag, and the
+# whole document when it has no elements
+Style = namedtuple('Style', 'head opening closing tail empty')
+# DC documents, exactly as DublinCore.makeXML(DC_NS) writes them
+DC_STYLE = Style(xmlhead(DC_NS), '\t<{0}>', '</{0}>\n', '</metadata>\n', None)
+# how toprettyxml() wrote an element holding text: from Python 2.7.3 on the
+# text is inline, before that it was indented on a line of its own
+if sys.version_info >= (2, 7, 3):
+	PRETTY_ELEMENT = ('\t<{0}>', '</{0}>\n')
+else:
+	PRETTY_ELEMENT = ('\t<{0}>\n\t\t', '\n\t</{0}>\n')
+# macrepo documents for --macrepo-style: pretty is byte for byte the layout
+# minidom's toprettyxml() gave them on the running Python, compact leaves
+# out the indentation
+MACREPO_STYLES = {
+	'pretty': Style('<?xml version="1.0" ?>\n<metadata xmlns:macrepo="{0}" xmlns:xsi="{1}">\n'.format(MACREPO_NS, XSI_NS),
+		PRETTY_ELEMENT[0], PRETTY_ELEMENT[1], '</metadata>\n',
+		'<?xml version="1.0" ?>\n<metadata xmlns:macrepo="{0}" xmlns:xsi="{1}"/>\n'.format(MACREPO_NS, XSI_NS)),
+	'compact': Style('<?xml version="1.0" encoding="UTF-8"?>\n<metadata xmlns:macrepo="{0}" xmlns:xsi="{1}">'.format(MACREPO_NS, XSI_NS),
+		'<{0}>', '</{0}>', '</metadata>\n',
+		'<?xml version="1.0" encoding="UTF-8"?>\n<metadata xmlns:macrepo="{0}" xmlns:xsi="{1}"/>\n'.format(MACREPO_NS, XSI_NS)),
+}
+
+# one unit of work for a run: rows start:end of fn, or all of fn when fields is None
+Job = namedtuple('Job', 'fn fields start end select indexed parser encoding mapping intern batch escapes style')
+
 class TabFile(object):
-	""" A dialect for the csv.DictReader constructor """
+	""" A dialect for the csv.reader constructor """
 	delimiter = '\t'
 
-def parse(fn):
-	""" Parse a TSV file """
+# cells may run to many megabytes, beyond the csv module's 128 KB default
+csv.field_size_limit(sys.maxint)
+
+class RowPlan(object):
+	"""
+	A TSV header compiled against a column mapping. The mapping is turned
+	into the source of one function for this particular header, which
+	reads each mapped column by position and fills in the defaults of
+	missing columns as constants, and is compiled once per header and
+	mapping. Rows are plain lists; build(row) returns the row's
+	DublinCoreRecord and its macrepo values, in macrepo element order,
+	and emit(row) the text of its DC and macrepo documents straight away.
+	With an EscapeCache both escape their values through it, and style is
+	the name of the layout of the macrepo documents.
+	"""
+	# generated functions by (header fields, mapping)
+	compiled = {}
+	# generated emitters by (header fields, mapping, style)
+	emitters = {}
+
+	def __init__(self, fields, mapping=MAPPING, escapes=None, style='pretty'):
+		self.width = len(fields)
+		self.escapes = escapes
+		self.style = style
+		index = dict((name, i) for i, name in enumerate(fields))
+		self.macrepo = macrepoelements(mapping)
+		self.layout = columnlayout(index, mapping, self.macrepo)
+		key = (tuple(fields), mapping)
+		if key not in self.compiled:
+			self.compiled[key] = compilerow(index, mapping, self.macrepo)
+		self.build = self.compiled[key]
+		if escapes:
+			# the same code, building records which escape through the cache
+			self.build = FunctionType(self.build.func_code, {'Record': escapes.record})
+		key += (style, )
+		if key not in self.emitters:
+			self.emitters[key] = compileemitter(self.layout, style)
+		self.emit = self.emitters[key]
+		if escapes:
+			self.emit = FunctionType(self.emit.func_code,
+				dict(self.emit.func_globals, escape=escapes, textescape=escapes.text))
+		# (position, column) of the mapped columns present in the header
+		self.columns = []
+		for col, element, delimiter, default in mapping:
+			if col in index and (index[col], col) not in self.columns:
+				self.columns.append((index[col], col))
+		column = [col for col, element, delimiter, default in mapping if element == 'Identifier']
+		if column and column[-1] in index:
+			self.identifier = itemgetter(index[column[-1]])
+		else:
+			self.identifier = lambda row: ''
+
+	def pad(self, row):
+		""" Fill in short rows """
+		if len(row) < self.width:
+			row.extend([''] * (self.width - len(row)))
+		return row
+
+def setdelimiters(mapping, specs):
+	"""
+	Override the delimiters of a mapping with COLUMN=DELIMITER specs; an
+	empty delimiter makes the column single-valued again
+	"""
+	delimiters = {}
+	for spec in specs:
+		col, sep, delimiter = spec.partition('=')
+		if not sep:
+			raise ValueError('--delimiter must look like COLUMN=DELIMITER')
+		delimiters[col] = delimiter or None
+	mapping = tuple((col, element, delimiters.get(col, delimiter), default)
+		for col, element, delimiter, default in mapping)
+	for col, element, delimiter, default in mapping:
+		if delimiter and element == 'Identifier':
+			raise ValueError('Identifier cannot hold several values')
+	return mapping
+
+def macrepoelements(mapping):
+	""" The macrepo elements of a mapping, in the order they first appear """
+	elements = []
+	for col, element, delimiter, default in mapping:
+		if element.startswith('macrepo:') and element not in elements:
+			elements.append(element)
+	return tuple(elements)
+
+def columnlayout(index, mapping, macrepo):
+	"""
+	What the columnar engine writes for a header: the DC elements in
+	makeXML order, then the macrepo elements, each as (tag, position,
+	delimiter, default, dc) where position is None for a missing column.
+	Each element is mapped once, loadmapping() rejects anything else.
+	"""
+	sources = dict((element, (index.get(col), delimiter, default))
+		for col, element, delimiter, default in mapping)
+	layout = [('dc:' + tag, ) + sources[attribute] + (True, )
+		for attribute, tag in ELEMENTS if attribute in sources]
+	layout.extend((element, ) + sources[element] + (False, ) for element in macrepo)
+	return layout
+
+def compilerow(index, mapping, macrepo):
+	"""
+	Generate and compile the row converter for a header's column index.
+	Columns of the header that nothing maps to cost nothing.
+	"""
+	body = ['def build(row):', '\trecord = Record()']
+	values = dict((element, repr('')) for element in macrepo)
+	for col, element, delimiter, default in mapping:
+		if col in index:
+			value = 'row[{0}]'.format(index[col])
+			if default:
+				value = '({0} or {1!r})'.format(value, default)
+			if delimiter:
+				value = '{0}.split({1!r})'.format(value, delimiter)
+		elif delimiter:
+			value = repr(default.split(delimiter))
+		else:
+			value = repr(default)
+		if element in values:
+			values[element] = value
+		elif value != repr(''):
+			body.append('\trecord.{0} = {1}'.format(element, value))
+	body.append('\treturn record, ({0})'.format(''.join(values[element] + ', ' for element in macrepo)))
+	namespace = {'Record': DublinCoreRecord}
+	exec '\n'.join(body) + '\n' in namespace
+	return namespace['build']
+
+def compileemitter(layout, style='pretty'):
+	"""
+	Generate and compile emit(row) for a columnlayout(), which writes the
+	DC and macrepo documents of a row in a single pass over its cells.
+	A cell is escaped once for all the elements it fills, and a row with
+	no markup characters is not escaped at all.
+	"""
+	style = MACREPO_STYLES[style]
+	body = ['def emit(row):', "\tjoined = '\\0'.join(row)", '\tdirty = not clean(joined)',
+		'\tquoted = dirty or \'"\' in joined']
+	dc, macrepo = [repr(DC_STYLE.head)], [repr(style.head)]
+	cells = set()
+	for tag, position, delimiter, default, isdc in layout:
+		pieces, quote, flag = (DC_STYLE, escape, 'dirty') if isdc else (style, textescape, 'quoted')
+		opening, closing = pieces.opening.format(tag), pieces.closing.format(tag)
+		if position is None:
+			text = repr(elements(default, tag, delimiter, isdc, None, pieces))
+		elif delimiter:
+			text = "''.join([{0!r} + ({1}(value) if {2} else value) + {3!r} for value in row[{4}].split({5!r})])".format(
+				opening, quote.__name__, flag, closing, position, delimiter)
+			if default:
+				# the default is not among the cells dirty looks at, so its
+				# elements are written and escaped here
+				text = '({0} if row[{1}] else {2!r})'.format(text, position,
+					elements(default, tag, delimiter, isdc, None, pieces))
+		else:
+			cell = '{0}{1}'.format('e' if isdc else 't', position)
+			if cell not in cells:
+				body.append('\t{0} = {1}(row[{2}]) if {3} else row[{2}]'.format(cell, quote.__name__, position, flag))
+				cells.add(cell)
+			if default:
+				text = '{0!r} + ({1} or {2!r}) + {3!r}'.format(opening, cell, quote(default), closing)
+			elif isdc:
+				# makeXML leaves out empty values
+				text = "({0!r} + {1} + {2!r} if {1} else '')".format(opening, cell, closing)
+			else:
+				text = '{0!r} + {1} + {2!r}'.format(opening, cell, closing)
+		(dc if isdc else macrepo).append(text)
+	dc.append(repr(DC_STYLE.tail))
+	macrepo.append(repr(style.tail))
+	if len(macrepo) == 2:
+		macrepo = [repr(style.empty)]
+	body.append("\treturn ''.join(({0}, )), ''.join(({1}, ))".format(', '.join(dc), ', '.join(macrepo)))
+	namespace = {'clean': clean, 'escape': escape, 'textescape': textescape}
+	exec '\n'.join(body) + '\n' in namespace
+	return namespace['emit']
+
+def loadmapping(fn):
+	"""
+	Read a column mapping file. Each line holds a TSV column, the element
+	it fills (a DublinCoreRecord attribute such as Title, or a macrepo:
+	element), and optionally a delimiter splitting it into several values
+	and a default for empty or missing cells, separated by tabs. Any
+	element but Identifier may be split into several values, and each
+	element may be filled by one column only. Blank lines and lines
+	starting with # are skipped.
+	"""
+	mapping = []
+	lines = {}
+	for number, line in enumerate(open(fn)):
+		line = line.rstrip('\r\n')
+		if not line.strip() or line.startswith('#'):
+			continue
+		parts = (line.split('\t') + ['', ''])[:4]
+		col, element, delimiter, default = parts
+		if element not in DublinCoreRecord.__slots__ and not element.startswith('macrepo:'):
+			raise ValueError('{0}, line {1}: unknown element {2!r}'.format(fn, number + 1, element))
+		if delimiter and element == 'Identifier':
+			raise ValueError('{0}, line {1}: Identifier cannot hold several values'.format(fn, number + 1))
+		if element in lines:
+			raise ValueError('{0}, line {1}: {2} is already filled by line {3}'.format(fn, number + 1, element,
+				lines[element]))
+		lines[element] = number + 1
+		mapping.append((col, element, delimiter or None, default))
+	return tuple(mapping)
+
+class ValuePool(object):
+	"""
+	Shares one copy of each value repeated down a column between the
+	rows of a run, for columns such as dc:publisher or dc:rights which
+	hold a handful of distinct values. A column is dropped from the pool
+	once it has more than limit distinct values, so unique columns like
+	dc:identifier cannot grow it without bound.
+	"""
+	def __init__(self, limit=POOL_LIMIT):
+		self.limit = limit
+		# column -> {value: shared copy}, or None once dropped
+		self.pools = {}
+		# column -> bytes of the duplicate copies replaced over the run
+		self.duplicates = {}
+
+	def add(self, columns):
+		""" Start pooling the columns of a (position, column) list not seen before """
+		for i, column in columns:
+			if column not in self.pools:
+				self.pools[column] = {}
+				self.duplicates[column] = 0
+
+	def share(self, row, columns):
+		""" Swap the values of a row in the given (position, column)s for their shared copies """
+		pools = self.pools
+		for i, column in columns:
+			pool = pools[column]
+			if pool is None:
+				continue
+			value = row[i]
+			shared = pool.get(value)
+			if shared is None:
+				if len(pool) >= self.limit:
+					pools[column] = None
+					continue
+				pool[value] = value
+			elif shared is not value:
+				row[i] = shared
+				self.duplicates[column] += sys.getsizeof(value)
+
+	def stats(self):
+		""" column -> (set of distinct values or None if dropped, duplicate bytes) """
+		return dict((column, (None if pool is None else set(pool), self.duplicates[column]))
+			for column, pool in self.pools.items())
+
+class EscapeCache(object):
+	"""
+	xml.sax.saxutils.escape keeping the results for the size most
+	recently used distinct values of up to ESCAPE_VALUE bytes, so that a
+	short value repeated across rows is escaped once while long ones are
+	never pinned in memory. hits and misses count the lookups. Calling the cache
+	escapes like makeXML, text() like macrepo text; record is a
+	DublinCoreRecord escaping through the cache.
+	"""
+	def __init__(self, size=ESCAPE_CACHE):
+		self.size = size
+		self.hits = self.misses = 0
+		self.links = {}
+		# circular list of [previous, next, value, escaped] links, from the
+		# least recently used value after root to the most recent before it
+		root = self.root = []
+		root[:] = [root, root, None, None]
+		self.record = type('CachedRecord', (DublinCoreRecord,), {'__slots__': (), 'escape': staticmethod(self)})
+
+	def __call__(self, value):
+		if len(value) > ESCAPE_VALUE:
+			self.misses += 1
+			return escape(value)
+		link = self.links.get(value)
+		if link is not None:
+			self.hits += 1
+			previous, next, value, escaped = link
+			previous[1] = next
+			next[0] = previous
+			root = self.root
+			last = root[0]
+			last[1] = root[0] = link
+			link[0] = last
+			link[1] = root
+			return escaped
+		self.misses += 1
+		escaped = escape(value)
+		if not self.size:
+			return escaped
+		root = self.root
+		if len(self.links) < self.size:
+			last = root[0]
+			link = [last, root, value, escaped]
+			last[1] = root[0] = link
+			self.links[value] = link
+		else:
+			# the root takes the new value and the oldest link becomes the root
+			root[2] = value
+			root[3] = escaped
+			self.links[value] = root
+			self.root = root[1]
+			del self.links[self.root[2]]
+			self.root[2] = self.root[3] = None
+		return escaped
+
+	def text(self, value):
+		""" Escape macrepo text, quotes included """
+		escaped = self(value)
+		return escaped.replace('"', '&quot;') if '"' in escaped else escaped
+
+	def counts(self, since=(0, 0)):
+		""" The (hits, misses) so far, or since an earlier counts() """
+		return self.hits - since[0], self.misses - since[1]
+
+# the EscapeCache of this process, see escapecache()
+ESCAPES = []
+
+def escapecache(size=ESCAPE_CACHE):
+	""" The EscapeCache shared by every job a process runs """
+	if not ESCAPES or ESCAPES[0].size != size:
+		ESCAPES[:] = [EscapeCache(size)]
+	return ESCAPES[0]
+
+def poolstats(results, limit=POOL_LIMIT):
+	""" Combine the ValuePool.stats() of several jobs """
+	merged = {}
+	for stats in results:
+		for column, (distinct, duplicates) in stats.items():
+			seen, total = merged.get(column, (set(), 0))
+			if seen is not None:
+				seen = None if distinct is None else seen | distinct
+			if seen is not None and len(seen) > limit:
+				seen = None
+			merged[column] = (seen, total + duplicates)
+	return merged
+
+class Selection(object):
+	"""
+	The part of every input file a run converts: an optional slice a:b of
+	the data rows (counted as lines, like Python slice indices), then one
+	of count shards. Range shards are contiguous byte ranges of whole
+	records a node can seek straight to; identifier shards keep the rows
+	whose CRC-32 of dc:identifier falls on index. Either way the shards
+	of a file add up to exactly the rows of a serial run.
+	"""
+	def __init__(self, rows=None, shard=None, by='range'):
+		self.rows = rows
+		self.index, self.count = shard or (0, 1)
+		self.hashed = by == 'identifier' and self.count > 1
+		self.ranged = by == 'range' and self.count > 1
+
+	def narrow(self, mm, start, end):
+		""" The byte range of a mapped file selected by the row slice and range shard """
+		if self.rows:
+			first, last = self.rows
+			start = skiplines(mm, start, end, first or 0)
+			if last is not None:
+				end = skiplines(mm, start, end, last - (first or 0))
+		if self.ranged:
+			bounds = boundaries(mm, start, end, self.count)
+			start, end = bounds[self.index], bounds[self.index + 1]
+		return start, end
+
+	def lines(self, lines):
+		""" Apply the row slice to a stream of lines, for inputs that cannot seek """
+		if self.rows:
+			return islice(lines, self.rows[0], self.rows[1])
+		return lines
+
+	def keep(self, identifier):
+		""" Does a row with this identifier belong to the identifier shard? """
+		return (zlib.crc32(identifier) & 0xffffffff) % self.count == self.index
+
+class DecodeError(ValueError):
+	""" Raised for TSV bytes which are not valid in the chosen --encoding, or cut short """
+
+class RowIndex(object):
+	"""
+	Hands out the lines of a byte range of a file, which start at offset
+	start, and passes on the rows read from them while remembering where
+	the current row starts and ends, so that convert() can record the
+	(identifier, offset, length) of every row for the sidecar index. A row
+	with quoted newlines spans all of its lines.
+	"""
+	def __init__(self, lines, start):
+		self.lines = iter(lines)
+		self.offset = self.end = self.pos = start
+		self.entries = []
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		line = self.lines.next()
+		self.pos += len(line)
+		return line
+
+	def rows(self, rows):
+		""" Pass on the rows read from the lines, noting the bytes of each """
+		for row in rows:
+			self.offset, self.end = self.end, self.pos
+			yield row
+
+	def record(self, identifier):
+		self.entries.append((identifier, self.offset, self.end - self.offset))
+
+def parse(fn, workers=1):
+	""" Parse a TSV file, optionally spreading its rows over worker processes """
+	return batch([fn], workers, quiet=True)
+
+def environmenterror(e):
+	""" The message for an EnvironmentError, naming its file if it has one """
+	if e.filename:
+		return "Error ({0}): {1}: {2}".format(e.errno, e.filename, e.strerror)
+	return "Error ({0}): {1}".format(e.errno, e.strerror)
+
+def batch(files, workers=1, quiet=False, sink=None, select=None, index=False, parser='auto', encoding=None,
+	mapping=MAPPING, intern=False, batch=0, escapes=ESCAPE_CACHE, style='pretty'):
+	"""
+	Convert a list of TSV files with one pool of worker processes shared
+	by the whole run, then report the throughput. Returns the row count.
+	A stream sink can only be used by a serial run, select restricts the
+	run to one Selection of each file, index writes a sidecar index next
+	to every uncompressed file and parser picks the row parser backend.
+	With an encoding the input is validated and written out as UTF-8,
+	mapping says which columns fill which elements and intern shares
+	repeated values through a ValuePool in each job, reporting on it.
+	batch is the block size of the columnar engine, 0 for row by row,
+	escapes the size of each process's EscapeCache and style the layout
+	of the macrepo documents.
+	"""
+	started = time()
+	try:
+		jobs = schedule(files, workers, select, index, parser, encoding, mapping, intern, batch, escapes,
+			style)
+		if workers > 1:
+			pool = Pool(workers)
+			results = list(pool.imap_unordered(convertrange, jobs))
+			pool.close()
+			pool.join()
+		else:
+			results = [convertrange(job, sink) for job in jobs]
+		if index:
+			parts = {}
+			for job in jobs:
+				if job.indexed:
+					parts.setdefault(job.fn, []).append(job.start)
+			for fn, starts in parts.items():
+				mergeindex(fn, starts)
+	except EnvironmentError as e:
+		print >> sys.stderr, environmenterror(e)
+		raise SystemExit(1)
+	except DecodeError as e:
+		print >> sys.stderr, "Error: {0}".format(e)
+		raise SystemExit(1)
+	rows = sum(result[0] for result in results)
+	if not quiet:
+		report(len(files), sum(job.end - job.start for job in jobs), rows, time() - started,
+			sorted(set(result[1] for result in results)))
+		if intern:
+			reportpool(poolstats(result[2] for result in results))
+		hits, misses = [sum(counts) for counts in zip(*[result[3] for result in results])] or (0, 0)
+		if hits or misses:
+			print >> sys.stderr, "Escape cache: {0} hits, {1} misses".format(hits, misses)
+	return rows
+
+def schedule(files, workers, select=None, index=False, parser='auto', encoding=None, mapping=MAPPING,
+	intern=False, batch=0, escapes=ESCAPE_CACHE, style='pretty'):
+	"""
+	Plan the Jobs for a run. With several workers plain files are cut into
+	byte ranges of whole records, at least four per worker across the run
+	and none larger than CHUNK_SIZE, and the largest jobs go first so the
+	pool finishes evenly. A serial run cuts a plain file being indexed
+	into ranges of at most CHUNK_SIZE, and one with a selection is a
+	single range. Compressed files, and in a serial run every other file,
+	are a single job with no header fields.
+	"""
+	sizes = [0 if fn == '-' else os.path.getsize(fn) for fn in files]
+	chunk = max(1, min(CHUNK_SIZE, sum(sizes) // (workers * 4)))
+	jobs = []
+	for fn, size in zip(files, sizes):
+		if fn == '-':
+			kind = 'stdin'
+		else:
+			fp = open(fn)
+			kind = sniff(fp.read(6))
+			fp.seek(0)
+		if kind == 'xz' and lzma is None:
+			print >> sys.stderr, "Error: reading xz files needs the lzma module"
+			raise SystemExit(1)
+		if kind and select and select.ranged:
+			print >> sys.stderr, "Error: {0} cannot be sharded by range, use --shard-by identifier".format(fn)
+			raise SystemExit(1)
+		if kind == 'stdin' and index:
+			print >> sys.stderr, "Warning: standard input cannot be indexed"
+		elif kind and index:
+			print >> sys.stderr, "Warning: {0} is compressed and will not be indexed".format(fn)
+		if not kind and (workers > 1 or select or index):
+			fields = readheader(fp.readline(), encoding, fn)
+			mm = mapfile(fp)
+			start, end = select.narrow(mm, fp.tell(), size) if select else (fp.tell(), size)
+			if workers > 1 or index:
+				# a serial run only cuts ranges for the memory of their index entries
+				pieces = max(1, -(-(end - start) // (chunk if workers > 1 else CHUNK_SIZE)))
+			else:
+				pieces = 1
+			# an empty file still gets a job so that its index is written
+			for lo, hi in splitranges(mm, start, end, pieces) or [(start, end)]:
+				jobs.append(Job(fn, fields, lo, hi, select, index, parser, encoding, mapping,
+					intern, batch, escapes, style))
+		else:
+			jobs.append(Job(fn, None, 0, size, select, False, parser, encoding, mapping, intern,
+				batch, escapes, style))
+		if fn != '-':
+			fp.close()
+	if workers > 1:
+		jobs.sort(key=lambda job: job.end - job.start, reverse=True)
+	return jobs
+
+def expand(args):
+	""" Expand file, glob and directory arguments into a list of TSV files """
+	files = []
+	for arg in args:
+		# unmatched arguments are kept so that opening them reports the error
+		for path in sorted(glob(arg)) or [arg]:
+			if os.path.isdir(path):
+				for root, dirs, names in os.walk(path):
+					dirs.sort()
+					files.extend(os.path.join(root, name) for name in sorted(names)
+						if name.endswith(TSV_SUFFIXES))
+			else:
+				files.append(path)
+	return files
+
+def report(files, size, rows, elapsed, backends=('csv',)):
+	""" Print a summary of a run to stderr """
+	elapsed = max(elapsed, 1e-6)
+	print >> sys.stderr, "Converted {0} rows from {1} files ({2:.1f} MB) in {3:.2f}s: {4:.0f} rows/s, {5:.2f} MB/s, parser: {6}".format(
+		rows, files, size / 1048576.0, elapsed, rows / elapsed, size / 1048576.0 / elapsed,
+		', '.join(backends) or 'none')
+
+def reportpool(stats, limit=POOL_LIMIT):
+	"""
+	Print the cardinality of each pooled column to stderr, with the bytes
+	of the duplicate values it replaced over the run. Blocks of rows are
+	released as they are written, so this is not memory held at once.
+	"""
+	for column in sorted(stats):
+		distinct, duplicates = stats[column]
+		if distinct is None:
+			print >> sys.stderr, "Interned {0}: over {1} distinct values, no longer pooled, {2:.1f} KB of duplicates".format(
+				column, limit, duplicates / 1024.0)
+		else:
+			print >> sys.stderr, "Interned {0}: {1} distinct values, {2:.1f} KB of duplicates".format(
+				column, len(distinct), duplicates / 1024.0)
+
+class SplitReader(object):
+	"""
+	Parser backend for input without quote characters: lines are cut on
+	tabs with str.split instead of going through the csv state machine.
+	With check set every line is looked at first, and from the first one
+	holding a quote the rest of the input is handed to the csv module so
+	that quoting is never misread. name says which backend ended up used.
+	"""
+	def __init__(self, lines, check=True):
+		self.lines = lines
+		self.check = check
+		self.name = 'split'
+
+	def __iter__(self):
+		lines = self.lines
+		for line in lines:
+			if self.check and '"' in line:
+				self.name = 'split+csv'
+				for row in csv.reader(chain([line], lines), dialect=TabFile):
+					yield row
+				return
+			line = line.rstrip('\r\n')
+			# csv.reader gives [] for a blank line too
+			yield line.split('\t') if line else []
+
+def rowreader(lines, parser='auto', quoted=None):
+	"""
+	Rows from lines using the parser backend: 'csv', 'split' or 'auto'.
+	quoted tells whether the input is known to hold quote characters,
+	None if that is unknown. 'auto' uses the split backend unless quotes
+	are known to be present, checking each line when it is not sure.
+	"""
+	if parser == 'csv' or (parser == 'auto' and quoted):
+		return csv.reader(lines, dialect=TabFile)
+	return SplitReader(lines, check=quoted is not False)
+
+def backend(rows):
+	""" Name of the parser backend behind a rowreader() """
+	return getattr(rows, 'name', 'csv')
+
+def convert(rows, plan, sink=None, keep=None, index=None, pool=None, batch=0):
+	"""
+	Write the Dublin Core and Macrepo files for each row, returns the row
+	count. keep, if given, is asked whether each identifier is converted,
+	index records where each converted row was found and pool is a
+	ValuePool sharing repeated values between rows. With a batch size the
+	rows are gathered into blocks of that many for writeblock(), or fewer
+	once their cells add up to BATCH_BYTES. A sink
+	that takes records, such as RdfSink, is given each row's record and
+	(element, value) pairs of its macrepo elements instead of documents.
+	"""
+	count = 0
+	block = []
+	held = 0
+	records = getattr(sink, 'records', False)
+	if pool:
+		pool.add(plan.columns)
+	for row in rows:
+		if not row:
+			continue
+		plan.pad(row)
+		identifier = plan.identifier(row)
+		if keep and not keep(identifier):
+			continue
+		if pool:
+			pool.share(row, plan.columns)
+		if records:
+			record, values = plan.build(row)
+			sink.add(identifier, record, zip(plan.macrepo, values))
+		elif batch:
+			block.append(row)
+			# quicker than summing the lengths of a row of short cells
+			held += len(''.join(row))
+			if len(block) == batch or held > BATCH_BYTES:
+				writeblock(block, plan, sink)
+				block = []
+				held = 0
+		else:
+			writerow(identifier, row, plan, sink)
+		if index:
+			index.record(identifier)
+		count += 1
+	if block:
+		writeblock(block, plan, sink)
+	return count
+
+def writeblock(rows, plan, sink=None):
+	"""
+	The columnar engine: write the documents of a block of padded rows,
+	building each element for a whole column at once and then putting
+	every row's documents together. The output is the same as writing
+	each row's record and macrepo XML. Rows with a cell longer than
+	STREAM_SIZE go through writerow() instead, in their place.
+	"""
+	columns = zip(*rows)
+	if max([max(imap(len, columns[position])) for tag, position, delimiter, default, isdc in plan.layout
+		if position is not None] or [0]) > STREAM_SIZE:
+		start = 0
+		for i, row in enumerate(rows):
+			if max(imap(len, row)) > STREAM_SIZE:
+				if start < i:
+					writecolumns(rows[start:i], plan, sink)
+				writerow(plan.identifier(row), row, plan, sink)
+				start = i + 1
+		if start < len(rows):
+			writecolumns(rows[start:], plan, sink)
+	else:
+		writecolumns(rows, plan, sink, columns)
+
+def writecolumns(rows, plan, sink=None, columns=None):
+	""" writeblock() for a block of rows without long cells, zip(*rows) may be given """
+	count = len(rows)
+	columns = columns or zip(*rows)
+	style = MACREPO_STYLES[plan.style]
+	dc, macrepo = [[DC_STYLE.head] * count], [[style.head] * count]
+	for tag, position, delimiter, default, isdc in plan.layout:
+		if position is None:
+			column = [elements(default, tag, delimiter, isdc, plan.escapes, DC_STYLE if isdc else style)] * count
+		else:
+			column = columns[position]
+			if default:
+				column = [value or default for value in column]
+			column = columnelements(column, tag, delimiter, isdc, plan.escapes, DC_STYLE if isdc else style)
+		(dc if isdc else macrepo).append(column)
+	dc.append([DC_STYLE.tail] * count)
+	macrepo.append([style.tail] * count)
+	if len(macrepo) == 2:
+		macrepo = [[style.empty] * count]
+	for identifier, dctext, macrepotext in zip(map(plan.identifier, rows), map(''.join, zip(*dc)),
+		map(''.join, zip(*macrepo))):
+		writetext(identifier + '-DC.xml', dctext, sink)
+		writetext(identifier + '-macrepo.xml', macrepotext, sink)
+
+def textescape(data):
+	""" Escape macrepo text the way minidom did, quotes included """
+	return escape(data, {'"': '&quot;'})
+
+def elements(value, tag, delimiter=None, dc=True, escapes=None, style=DC_STYLE):
+	"""
+	The XML elements for one cell: a DC element as DublinCore.makeXML
+	writes it, which leaves out empty values, or a macrepo element, which
+	escapes quotes as well, laid out in the given Style and escaped
+	through the EscapeCache if there is one
+	"""
+	if escapes:
+		quote = escapes if dc else escapes.text
+	else:
+		quote = escape if dc else textescape
+	values = value.split(delimiter) if delimiter else [value] if value or not dc else []
+	opening, closing = style.opening.format(tag), style.closing.format(tag)
+	return ''.join(opening + quote(value) + closing for value in values)
+
+def columnelements(column, tag, delimiter=None, dc=True, escapes=None, style=DC_STYLE):
+	"""
+	elements() for every cell of a column. The column is joined into one
+	string with NUL separators, split on the delimiter, escaped and
+	templated by str methods running over the whole of it, then cut back
+	into one string per cell. Only cells done one by one go through the
+	EscapeCache.
+	"""
+	joined = '\0'.join(column)
+	if joined.count('\0') != len(column) - 1 or '\1' in joined:
+		# cells holding the separators themselves are done one by one
+		return [elements(value, tag, delimiter, dc, escapes, style) for value in column]
+	opening, closing = style.opening.format(tag), style.closing.format(tag)
+	if delimiter:
+		joined = joined.replace(delimiter, '\1')
+	joined = (escape if dc else textescape)(joined)
+	text = opening + joined.replace('\1', closing + opening).replace('\0', closing + '\0' + opening) + closing
+	if dc and not delimiter:
+		# empty values are left out, escaped text cannot hold a closing tag
+		text = ('\0' + text).replace('\0' + opening + closing, '\0')[1:]
+	return text.split('\0')
+
+class FileMap(object):
+	"""
+	Read-only access to a file through the find, rfind, slicing and len
+	of an mmap, served from one window of the file mapped at a time. The
+	pages of a mapping count as resident once they are touched, so only
+	WINDOW_SIZE bytes of the file are mapped at once, plus any slice
+	reaching past them. find and rfind look for a single character.
+	"""
+	def __init__(self, fp):
+		self.fp = fp
+		self.size = os.fstat(fp.fileno()).st_size
+		self.mm = ''
+		self.base = self.top = 0
+
+	def __len__(self):
+		return self.size
+
+	def map(self, start, length=0):
+		""" Map the window from start, or a little before, to at least start + length """
+		base = start - start % mmap.ALLOCATIONGRANULARITY
+		top = min(self.size, max(start + length, base + WINDOW_SIZE))
+		if self.mm:
+			self.mm.close()
+		self.mm = mmap.mmap(self.fp.fileno(), top - base, access=mmap.ACCESS_READ, offset=base)
+		self.base, self.top = base, top
+
+	def __getitem__(self, index):
+		start, stop, step = index.indices(self.size)
+		if stop <= start:
+			return ''
+		if not self.base <= start < stop <= self.top:
+			self.map(start, stop - start)
+		return self.mm[start - self.base:stop - self.base]
+
+	def find(self, sub, start=0, end=None):
+		start, end, step = slice(start, end).indices(self.size)
+		while start < end:
+			if not self.base <= start < self.top:
+				self.map(start)
+			stop = min(end, self.top)
+			found = self.mm.find(sub, start - self.base, stop - self.base)
+			if found >= 0:
+				return found + self.base
+			start = stop
+		return -1
+
+	def rfind(self, sub, start=0, end=None):
+		start, end, step = slice(start, end).indices(self.size)
+		while start < end:
+			if not self.base < end <= self.top:
+				lo = max(start, end - WINDOW_SIZE)
+				self.map(lo, end - lo)
+			lo = max(start, self.base)
+			found = self.mm.rfind(sub, lo - self.base, end - self.base)
+			if found >= 0:
+				return found + self.base
+			end = lo
+		return -1
+
+def mapfile(fp):
+	""" Map an open file read-only through a FileMap, so resident memory stays flat however large it is """
+	return FileMap(fp)
+
+def maplines(mm, start, end):
+	""" Yield the lines of a mapped file between two byte offsets """
+	find = mm.find
+	pos = start
+	while pos < end:
+		nl = find('\n', pos, end)
+		if nl < 0:
+			nl = end - 1
+		yield mm[pos:nl + 1]
+		pos = nl + 1
+
+def mapblocks(mm, start, end, size=BLOCK_SIZE):
+	""" Yield blocks of about size bytes of a mapped file, cut after a newline """
+	while start < end:
+		stop = start + size
+		if stop < end:
+			nl = mm.find('\n', stop, end)
+			stop = end if nl < 0 else nl + 1
+		else:
+			stop = end
+		yield mm[start:stop]
+		start = stop
+
+def countlines(mm, end):
+	""" Number of newlines in a mapped file before offset end """
+	return sum(mm[pos:min(pos + BLOCK_SIZE, end)].count('\n') for pos in xrange(0, end, BLOCK_SIZE))
+
+def transcode(blocks, encoding, fn, fields=None, lineat=lambda seen: seen + 1):
+	"""
+	Decode blocks of TSV text, each ending on a line boundary, from the
+	given encoding a whole block at a time and yield them as UTF-8. UTF-8
+	input is only validated and passes through as it is. A byte that does
+	not decode raises DecodeError naming its line and column; lineat turns
+	the number of newlines seen before it into a line number of the file.
+	Without fields the first line of the blocks is taken as the header.
+	"""
+	utf8 = codecs.lookup(encoding).name == 'utf-8'
+	seen = 0
+	for block in blocks:
+		if fields is None:
+			fields = block.split('\n', 1)[0].split('\t')
+		try:
+			text = block.decode(encoding)
+		except UnicodeDecodeError as e:
+			head = block[:e.start]
+			column = head.count('\t', head.rfind('\n') + 1)
+			name = fields[column] if fields and column < len(fields) else ''
+			raise DecodeError("{0}: byte 0x{1:02x} is not valid {2}, line {3}, column {4} {5}".format(
+				fn, ord(block[e.start]), encoding, lineat(seen + head.count('\n')), column + 1, name).rstrip())
+		yield block if utf8 else text.encode('utf-8')
+		seen += block.count('\n')
+
+def readheader(line, encoding=None, fn=''):
+	""" Split the header line of a TSV file into field names """
+	if encoding:
+		line = next(transcode([line], encoding, fn))
+	return line.rstrip('\n').split('\t')
+
+def sniff(head):
+	""" Name the compression format of a file from its first bytes """
+	for magic, kind in MAGIC:
+		if head.startswith(magic):
+			return kind
+	return None
+
+def decompressor(kind):
+	""" A fresh incremental decompressor for one gzip, bz2 or xz stream """
+	if kind == 'gzip':
+		return zlib.decompressobj(16 + zlib.MAX_WBITS)
+	elif kind == 'bz2':
+		return bz2.BZ2Decompressor()
+	return lzma.LZMADecompressor()
+
+def finished(d):
+	"""
+	Has a decompressor reached the end of its stream? zlib has no eof
+	flag before Python 3.3, but a byte fed past the end of a stream is
+	kept as unused data, while bz2 and lzma refuse it.
+	"""
+	if hasattr(d, 'eof'):
+		return d.eof
+	try:
+		d.decompress('\0')
+	except EOFError:
+		return True
+	except (zlib.error, IOError):
+		return False
+	return bool(d.unused_data)
+
+def inflate(blocks, kind, fn='', depth=8):
+	"""
+	Yield the decompressed contents of an iterable of compressed blocks in
+	chunks. Reading and decompression run on
+	a background thread which stays at most depth chunks ahead, so it
+	overlaps with conversion without holding the whole file in memory.
+	Concatenated streams, as written by pigz or pbzip2, are followed, and
+	input ending before its last stream does raises DecodeError naming fn.
+	Closing the generator stops the thread and waits for it, so that a
+	consumer giving up early can close the file behind it.
+	"""
+	chunks = Queue(depth)
+	stop = Event()
+
+	def pump():
+		try:
+			d = decompressor(kind)
+			for block in blocks:
+				while block and not stop.is_set():
+					data = d.decompress(block)
+					if data:
+						chunks.put(data)
+					block = d.unused_data
+					if block:
+						d = decompressor(kind)
+				if stop.is_set():
+					return
+			if not finished(d):
+				raise DecodeError("{0}: the {1} stream is truncated".format(fn, kind))
+			chunks.put(None)
+		except Exception as e:
+			chunks.put(e)
+
+	pumper = Thread(target=pump)
+	pumper.daemon = True
+	pumper.start()
+	try:
+		for data in iter(chunks.get, None):
+			if isinstance(data, Exception):
+				raise data
+			yield data
+	finally:
+		stop.set()
+		# take what the thread is trying to put until it sees stop
+		while pumper.is_alive():
+			try:
+				chunks.get(timeout=0.1)
+			except Empty:
+				pass
+		pumper.join()
+
+def alignblocks(chunks):
+	""" Regroup a sequence of text chunks into blocks which end on a newline """
+	tail = ''
+	for chunk in chunks:
+		data = tail + chunk
+		end = data.rfind('\n') + 1
+		if end:
+			yield data[:end]
+		tail = data[end:]
+	if tail:
+		yield tail
+
+def chunklines(chunks):
+	""" Yield whole lines from a sequence of text chunks """
+	for block in alignblocks(chunks):
+		for line in maplines(block, 0, len(block)):
+			yield line
+
+def boundaries(mm, start, end, n):
+	"""
+	Cut start:end of a mapped TSV file at n - 1 record ends spaced as
+	evenly as possible, returns the n + 1 offsets. Adjacent offsets may
+	be equal. start must be the start of a record.
+	"""
+	step = (end - start) // n
+	bounds = [start]
+	for i in range(1, n):
+		# step back one byte so a range can end exactly on a newline
+		bounds.append(recordcut(mm, bounds[-1], max(start + i * step - 1, 0), end))
+	bounds.append(end)
+	return bounds
+
+def recordcut(mm, pos, target, end):
+	"""
+	The offset just past the first newline at or after target that ends
+	a record, reading from the record start pos. The file is looked at a
+	block of whole lines at a time, a larger one when a record runs past
+	the block it starts in.
+	"""
+	size = BLOCK_SIZE
+	while pos <= target:
+		block = mm[pos:min(pos + size, end)]
+		whole = pos + len(block) == end
+		if not whole:
+			block = block[:block.rfind('\n') + 1]
+		offset, done = blockcut(block, target - pos, whole)
+		if done:
+			return pos + offset
+		if offset:
+			pos, size = pos + offset, BLOCK_SIZE
+		else:
+			size *= 2
+	return pos
+
+def blockcut(block, target, whole=True):
+	"""
+	recordcut() within a block of lines starting on a record, whole if it
+	runs to the end of the range. Returns the offset and True once found,
+	or the last record start seen and False when the block runs out first.
+	Quote-free stretches are skipped with find, lines from one holding a
+	quote are read with the csv module for as long as quotes keep coming,
+	as their records may go on over quoted newlines.
+	"""
+	find = block.find
+	size = len(block)
+	pos = 0
+	read = [0]
+
+	def lines():
+		for line in maplines(block, read[0], size):
+			read[0] += len(line)
+			yield line
+
+	while pos <= target:
+		nl = find('\n', target)
+		stop = size if nl < 0 else nl + 1
+		quote = find('"', pos, stop)
+		if quote < 0:
+			return stop, nl >= 0 or whole
+		read[0] = block.rfind('\n', pos, quote) + 1 or pos
+		begin = read[0]
+		for row in csv.reader(lines(), dialect=TabFile):
+			pos = read[0]
+			if pos == size and not whole:
+				# the record may go on in the next block
+				return begin, False
+			nl = find('\n', pos, stop)
+			if pos > target or nl < 0 or find('"', pos, nl) < 0:
+				break
+			begin = pos
+		else:
+			return size, True
+	return pos, True
+
+def splitranges(mm, start, end, n):
+	""" Split start:end of a mapped TSV file into at most n non-empty record ranges """
+	bounds = boundaries(mm, start, end, n)
+	return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if lo < hi]
+
+def skiplines(mm, pos, end, n):
+	""" The offset n lines after pos in a mapped file, or end """
+	while n and pos < end:
+		block = mm[pos:min(pos + BLOCK_SIZE, end)]
+		count = block.count('\n')
+		if count >= n:
+			nl = -1
+			for i in xrange(n):
+				nl = block.find('\n', nl + 1)
+			return pos + nl + 1
+		n -= count
+		pos += len(block)
+	return min(pos, end)
+
+def convertfile(fn, sink=None, select=None, parser='auto', encoding=None, mapping=MAPPING, intern=False,
+	batch=0, escapes=ESCAPE_CACHE, style='pretty'):
+	"""
+	Convert a whole TSV file, plain or compressed. The file name '-' reads
+	standard input in blocks, keeping memory flat. Returns the row count,
+	the parser backend used, with intern the ValuePool.stats(), and the
+	EscapeCache counts.
+	"""
+	fp = sys.stdin if fn == '-' else open(fn)
+	inflater = None
 	try:
-		fp = open(fn)
-		fields = fp.readline().rstrip('\n').split('\t')
-		tsv = csv.DictReader(fp, fieldnames=fields, dialect=TabFile)
-		for row in tsv:
-			dc = makedc(row)
-			writefile(row['dc:identifier'], dc)
-			xml = makexml(row)
-			writefile(row['dc:identifier'], xml)
-	except IOError as (errno, strerror):
-		print "Error ({0}): {1}".format(errno, strerror)
-		raise SystemExit
+		head = fp.read(BLOCK_SIZE)
+		kind = sniff(head)
+		if kind or fn == '-':
+			blocks = chain([head], iter(lambda: fp.read(BLOCK_SIZE), ''))
+			# only plain text can be sampled, a later quote is still caught
+			quoted = None if kind or '"' not in head else True
+			if kind:
+				blocks = inflater = inflate(blocks, kind, fn)
+			if encoding:
+				blocks = transcode(alignblocks(blocks), encoding, fn)
+			lines = chunklines(blocks)
+		else:
+			mm = mapfile(fp)
+			if encoding:
+				lines = chunklines(transcode(mapblocks(mm, 0, len(mm)), encoding, fn))
+			else:
+				lines = chunklines(mapblocks(mm, 0, len(mm)))
+			quoted = mm.find('"') >= 0
+		fields = readheader(next(lines, ''))
+		keep = None
+		if select:
+			lines = select.lines(lines)
+			keep = select.keep if select.hashed else None
+		rows = rowreader(lines, parser, quoted)
+		pool = ValuePool() if intern else None
+		escapes = escapecache(escapes)
+		counts = escapes.counts()
+		count = convert(rows, RowPlan(fields, mapping, escapes, style), sink, keep, pool=pool, batch=batch)
+	finally:
+		# stop the decompression thread before its file goes away
+		if inflater:
+			inflater.close()
+		if fp is not sys.stdin:
+			fp.close()
+	return count, backend(rows), pool.stats() if pool else None, escapes.counts(counts)
+
+def convertrange(job, sink=None):
+	"""
+	Worker process entry point: convert the rows of one scheduled Job,
+	returns the row count, the parser backend used, the pool stats and
+	the escape cache counts
+	"""
+	if job.fields is None:
+		return convertfile(job.fn, sink, job.select, job.parser, job.encoding, job.mapping, job.intern,
+			job.batch, job.escapes, job.style)
+	fn, start = job.fn, job.start
+	fp = open(fn)
+	mm = mapfile(fp)
+	if job.encoding:
+		lines = chunklines(transcode(mapblocks(mm, start, job.end), job.encoding, fn, job.fields,
+			lambda seen: countlines(mm, start) + seen + 1))
+	else:
+		lines = chunklines(mapblocks(mm, start, job.end))
+	index = RowIndex(lines, start) if job.indexed else None
+	rows = rowreader(index or lines, job.parser, mm.find('"', start, job.end) >= 0)
+	keep = job.select.keep if job.select and job.select.hashed else None
+	pool = ValuePool() if job.intern else None
+	escapes = escapecache(job.escapes)
+	counts = escapes.counts()
+	count = convert(index.rows(rows) if index else rows, RowPlan(job.fields, job.mapping, escapes, job.style),
+		sink, keep, index, pool, job.batch)
 	fp.close()
+	if index:
+		index.entries.sort()
+		part = open(indexpart(fn, start), 'w')
+		part.writelines('{0}\t{1}\t{2}\n'.format(*entry) for entry in index.entries)
+		part.close()
+	return count, backend(rows), pool.stats() if pool else None, escapes.counts(counts)
+
+def indexpart(fn, start):
+	""" Name of the partial index a job starting at start writes """
+	return '{0}{1}.{2}'.format(fn, INDEX_SUFFIX, start)
+
+def indexstamp(fn):
+	""" First line of an index, ties it to the size and mtime of its TSV """
+	st = os.stat(fn)
+	return '#{0}\t{1}\n'.format(st.st_size, int(st.st_mtime))
+
+def readpart(fn):
+	""" Yield the (identifier, offset, length) entries of a partial index """
+	for line in open(fn):
+		identifier, offset, length = line.rstrip('\n').split('\t')
+		yield identifier, int(offset), int(length)
+
+def mergeindex(fn, starts):
+	"""
+	Merge the sorted partial indexes of a file's jobs into its sidecar
+	index: a stamp line, then one identifier, offset and length per line
+	in identifier order, which lookup() can binary search
+	"""
+	parts = [indexpart(fn, start) for start in starts]
+	out = open(fn + INDEX_SUFFIX, 'w')
+	out.write(indexstamp(fn))
+	out.writelines('{0}\t{1}\t{2}\n'.format(*entry)
+		for entry in heapq.merge(*[readpart(part) for part in parts]))
+	out.close()
+	for part in parts:
+		os.remove(part)
+
+def lookup(mm, identifier):
+	""" Yield the (offset, length) of every row for identifier in a mapped index """
+	lo, hi = mm.find('\n') + 1, len(mm)
+	# lo and hi stay on line starts, lines before lo sort below identifier
+	while lo < hi:
+		mid = (lo + hi) // 2
+		start = mm.rfind('\n', lo, mid) + 1 or lo
+		end = mm.find('\n', start, hi)
+		if mm[start:end].split('\t', 1)[0] < identifier:
+			lo = end + 1
+		else:
+			hi = start
+	key = identifier + '\t'
+	while mm[lo:lo + len(key)] == key:
+		end = mm.find('\n', lo)
+		offset, length = mm[lo + len(key):end].split('\t')
+		yield int(offset), int(length)
+		lo = end + 1
+
+def regenerate(files, identifiers, quiet=False, sink=None, encoding=None, mapping=MAPPING, style='pretty'):
+	"""
+	Convert only the rows of the given identifiers, found through the
+	sidecar index of each file instead of a pass over the whole file
+	"""
+	started = time()
+	found = set()
+	rows = 0
+	try:
+		for fn in files:
+			if not os.path.exists(fn + INDEX_SUFFIX):
+				print >> sys.stderr, "Error: {0} has no index, convert it once with --index".format(fn)
+				raise SystemExit(1)
+			fp = open(fn)
+			idx = open(fn + INDEX_SUFFIX)
+			index = mapfile(idx)
+			if index[:index.find('\n') + 1] != indexstamp(fn):
+				print >> sys.stderr, "Error: the index of {0} is out of date, convert it again with --index".format(fn)
+				raise SystemExit(1)
+			fields = readheader(fp.readline(), encoding, fn)
+			plan = RowPlan(fields, mapping, style=style)
+			mm = mapfile(fp)
+			for identifier in identifiers:
+				lines = [mm[offset:offset + length] for offset, length in lookup(index, identifier)]
+				if lines and encoding:
+					offset = lookup(index, identifier).next()[0]
+					lines = list(transcode(lines, encoding, fn, fields, lambda seen: countlines(mm, offset) + 1))
+				if lines:
+					found.add(identifier)
+					rows += convert(csv.reader(lines, dialect=TabFile), plan, sink)
+			idx.close()
+			fp.close()
+	except EnvironmentError as e:
+		print >> sys.stderr, environmenterror(e)
+		raise SystemExit(1)
+	except DecodeError as e:
+		print >> sys.stderr, "Error: {0}".format(e)
+		raise SystemExit(1)
+	for identifier in identifiers:
+		if identifier not in found:
+			print >> sys.stderr, "Warning: {0} was not found".format(identifier)
+	if not quiet:
+		report(len(files), 0, rows, time() - started)
+	return rows
 
 def makedc(row):
 	""" Generate a Dublin Core XML file from a TSV """
-	metadata = DublinCore()
-	metadata.Contributor = row.get('dc:contributor', '')
-	metadata.Coverage = row.get('dc:coverage', '')
-	metadata.Creator = row.get('dc:creator', '')
-	metadata.Date = row.get('dc:date', '')
-	metadata.Description = row.get('dc:description', '')
-	metadata.Format = row.get('dc:format', '')
-	metadata.Identifier = row.get('dc:identifier', '')
-	metadata.Language = row.get('dc:language', '')
-	metadata.Publisher = row.get('dc:publisher', '')
-	metadata.Relation = row.get('dc:relation', '').split('|')
-	metadata.Rights = row.get('dc:rights', '')
-	metadata.Source = row.get('dc:source', '')
-	metadata.Subject = row.get('dc:subject', '')
-	metadata.Title = row.get('dc:title', '')
+	return builddc([row.get(col, '') for col in DC_COLUMNS])
+
+def builddc(values):
+	""" Generate a Dublin Core XML file from row values in DC_COLUMNS order """
+	metadata = DublinCoreRecord()
+	(metadata.Contributor, metadata.Coverage, metadata.Creator, metadata.Date,
+		metadata.Description, metadata.Format, metadata.Identifier,
+		metadata.Language, metadata.Publisher, metadata.Relation,
+		metadata.Rights, metadata.Source, metadata.Subject,
+		metadata.Title) = values
+	metadata.Relation = metadata.Relation.split('|')
 	return metadata
 
-def makexml(row):
+def makexml(row, style='pretty'):
 	""" Generate an XML file conforming to the macrepo schema from a TSV """
-	doc = Document()
-	root = doc.createElement('metadata')
-	root.setAttribute('xmlns:xsi', XSI_NS)
-	root.setAttribute('xmlns:macrepo', MACREPO_NS)
-	doc.appendChild(root)
-	oldnid = doc.createElement('macrepo:oldNid')
-	oldnid.appendChild(doc.createTextNode(row.get('macrepo:oldNid', '')))
-	root.appendChild(oldnid)
-	notes = doc.createElement('macrepo:notes')
-	notes.appendChild(doc.createTextNode(row.get('macrepo:notes', '')))
-	root.appendChild(notes)
-	scale = doc.createElement('macrepo:scale')
-	scale.appendChild(doc.createTextNode(row.get('macrepo:scale', '')))
-	root.appendChild(scale)
-	return doc
-
-def writefile(name, obj):
-	""" Writes Dublin Core or Macrepo XML object to a file """
-	if isinstance(obj, DublinCore):
-		fp = open(name + '-DC.xml', 'w')
-		fp.write(obj.makeXML(DC_NS))
-	elif isinstance(obj, Document):
-		fp = open(name + '-macrepo.xml', 'w')
-		fp.write(obj.toprettyxml())
-	fp.close()
+	return buildxml([row.get(col, '') for col in MACREPO_COLUMNS], style=style)
+
+def buildxml(values, elements=MACREPO_COLUMNS, style='pretty', escapes=None):
+	"""
+	Generate the text of a macrepo XML document from row values for the
+	given elements, in one of the MACREPO_STYLES. A list value is written
+	as one element per entry.
+	"""
+	return ''.join(macrepopieces(values, elements, style, escapes))
+
+def macrepopieces(values, elements=MACREPO_COLUMNS, style='pretty', escapes=None):
+	"""
+	The text of buildxml() a piece at a time. Values longer than
+	STREAM_SIZE are escaped and yielded a chunk at a time.
+	"""
+	style = MACREPO_STYLES[style]
+	quote = escapes.text if escapes else textescape
+	values = [value if isinstance(value, list) else [value] for value in values]
+	if not any(values[:len(elements)]):
+		yield style.empty
+		return
+	yield style.head
+	for tag, value in zip(elements, values):
+		opening, closing = style.opening.format(tag), style.closing.format(tag)
+		for value in value:
+			yield opening
+			if len(value) > STREAM_SIZE:
+				for chunk in escapechunks(value, textescape, STREAM_SIZE):
+					yield chunk
+			elif value:
+				yield quote(value)
+			yield closing
+	yield style.tail
+
+def writefile(name, obj, sink=None):
+	"""
+	Writes a Dublin Core object or the text of a Macrepo XML document to
+	a file, or hands it to a stream sink under the file name it would have
+	had
+	"""
+	if isinstance(obj, (DublinCore, DublinCoreRecord)):
+		fn, text = name + '-DC.xml', obj.makeXML(DC_NS)
+	else:
+		fn, text = name + '-macrepo.xml', obj
+	writetext(fn, text, sink)
+
+def writetext(fn, text, sink=None):
+	""" Writes a document to the file fn, or hands it to a stream sink """
+	if sink:
+		sink.write(fn, text)
+	else:
+		fp = open(fn, 'w')
+		fp.write(text)
+		fp.close()
+
+def writepieces(fn, pieces, sink=None):
+	"""
+	Writes a document given as an iterable of strings to the file fn, or
+	to a stream sink, as they are produced rather than joined first
+	"""
+	if sink:
+		sink.writelines(fn, pieces)
+	else:
+		fp = open(fn, 'w')
+		fp.writelines(pieces)
+		fp.close()
+
+def writerow(identifier, row, plan, sink=None):
+	"""
+	Write the documents of a padded row. A row with a cell longer than
+	STREAM_SIZE goes through the streaming writer, so that its documents
+	are never held in memory whole.
+	"""
+	if max(imap(len, row)) > STREAM_SIZE:
+		record, macrepo = plan.build(row)
+		writepieces(identifier + '-DC.xml', record.iterXML(DC_NS), sink)
+		writepieces(identifier + '-macrepo.xml', macrepopieces(macrepo, plan.macrepo, plan.style, plan.escapes),
+			sink)
+	else:
+		dc, macrepo = plan.emit(row)
+		writetext(identifier + '-DC.xml', dc, sink)
+		writetext(identifier + '-macrepo.xml', macrepo, sink)
+
+class TarSink(object):
+	""" Writes documents as members of an uncompressed tar stream """
+	def __init__(self, fp):
+		self.tar = tarfile.open(fileobj=fp, mode='w|')
+		self.mtime = time()
+
+	def write(self, fn, text):
+		info = tarfile.TarInfo(fn)
+		info.size = len(text)
+		info.mtime = self.mtime
+		info.mode = 0644
+		self.tar.addfile(info, StringIO(text))
+
+	def writelines(self, fn, pieces):
+		# a member's size comes first, so the document is measured in a spool
+		spool = SpooledTemporaryFile(SPOOL_SIZE)
+		spool.writelines(pieces)
+		info = tarfile.TarInfo(fn)
+		info.size = spool.tell()
+		info.mtime = self.mtime
+		info.mode = 0644
+		spool.seek(0)
+		self.tar.addfile(info, spool)
+		spool.close()
+
+	def close(self):
+		self.tar.close()
+
+class XmlSink(object):
+	""" Writes documents back to back, each one followed by a NUL byte """
+	def __init__(self, fp):
+		self.fp = fp
+
+	def write(self, fn, text):
+		self.fp.write(text)
+		self.fp.write('\0')
+
+	def writelines(self, fn, pieces):
+		self.fp.writelines(pieces)
+		self.fp.write('\0')
+
+	def close(self):
+		self.fp.flush()
+
+class PartWriter(object):
+	"""
+	The output of a record sink: fp, or with a prefix numbered part files
+	PREFIX-00000.EXT, PREFIX-00001.EXT, ... in the current directory. A
+	part is ended before a record that would take it past size bytes,
+	unless it holds no record yet, or once it holds count records if
+	count is set. Every part starts with head and ends with tail, so each
+	one can be loaded on its own; subclasses may vary them by part
+	through opening() and closing().
+	"""
+	def __init__(self, fp, head='', tail='', prefix=None, ext='', size=0, count=0):
+		self.out = fp
+		self.fp = None
+		self.head = head
+		self.tail = tail
+		self.prefix = prefix
+		self.ext = ext
+		self.size = size
+		self.count = count
+		self.parts = 0
+		self.written = 0
+		self.records = 0
+		self.total = 0
+
+	def name(self, part):
+		return '{0}-{1:05d}'.format(self.prefix, part)
+
+	def opening(self):
+		return self.head
+
+	def closing(self, last):
+		return self.tail
+
+	def begin(self):
+		if self.prefix:
+			self.fp = open(self.name(self.parts) + '.' + self.ext, 'wb')
+		else:
+			self.fp = self.out
+		head = self.opening()
+		self.parts += 1
+		self.fp.write(head)
+		self.written = len(head) + len(self.tail)
+		self.records = 0
+
+	def end(self, last=False):
+		self.fp.write(self.closing(last))
+		self.total += self.records
+		if self.prefix:
+			self.fp.close()
+		else:
+			self.fp.flush()
+		self.fp = None
+
+	def write(self, text):
+		if self.fp and self.prefix and self.records and (self.written + len(text) > self.size or
+			self.records == self.count):
+			self.end()
+		if not self.fp:
+			self.begin()
+		self.fp.write(text)
+		self.written += len(text)
+		self.records += 1
+
+	def close(self):
+		if not self.parts:
+			self.begin()
+		if self.fp:
+			self.end(True)
+
+class RecordSink(object):
+	"""
+	A sink given every row's record rather than its documents, which it
+	writes to a PartWriter through the record method named by method.
+	The subject of a record is the URI of its identifier under base, or a
+	numbered blank node if it has none; nothing is held between records.
+	"""
+	records = True
+	head = tail = ext = method = ''
+
+	def __init__(self, fp, base='', prefix=None, size=0, count=0):
+		self.out = PartWriter(fp, self.head, self.tail, prefix, self.ext, size, count)
+		self.base = base
+		self.blanks = 0
+
+	def subject(self, identifier):
+		if identifier:
+			return '<{0}>'.format(self.base + quote(identifier, URI_SAFE))
+		self.blanks += 1
+		return '_:b{0}'.format(self.blanks)
+
+	def add(self, identifier, record, macrepo):
+		self.out.write(getattr(record, self.method)(self.subject(identifier)))
+
+	def close(self):
+		self.out.close()
+
+class RdfSink(RecordSink):
+	""" Writes every record as an rdf:Description of one RDF/XML document """
+	head, tail, ext = RDF_HEAD, RDF_TAIL, 'rdf'
+
+	def add(self, identifier, record, macrepo):
+		about = self.base + quote(identifier, URI_SAFE) if identifier else ''
+		self.out.write(record.rdfDescription(about))
+
+class NTriplesSink(RecordSink):
+	""" Writes the triples of every record as N-Triples """
+	ext, method = 'nt', 'makeNTriples'
+
+class TurtleSink(RecordSink):
+	""" Writes every record as a Turtle statement """
+	head, ext, method = TURTLE_HEAD, 'ttl', 'makeTurtle'
+
+class JsonSink(RecordSink):
+	""" Writes every record as a line of JSON, see jsondocument() """
+	ext = 'jsonl'
+
+	def add(self, identifier, record, macrepo):
+		self.out.write(jsondocument(identifier, record, macrepo) + '\n')
+
+class BulkSink(RecordSink):
+	""" Writes every record for the Elasticsearch bulk API, an index action then the document """
+	ext = 'ndjson'
+
+	def add(self, identifier, record, macrepo):
+		action = '{{"index": {{"_id": {0}}}}}\n'.format(encodejson(identifier)) if identifier else '{"index": {}}\n'
+		self.out.write(action + jsondocument(identifier, record, macrepo) + '\n')
+
+class SolrSink(RecordSink):
+	""" Writes every record as an add command of a Solr JSON update, committed at the end of each part """
+	head, tail, ext = '{\n', '"commit": {}\n}\n', 'json'
+
+	def add(self, identifier, record, macrepo):
+		self.out.write('"add": {"doc": ' + jsondocument(identifier, record, macrepo) + '},\n')
+
+class OaiPages(PartWriter):
+	"""
+	An OAI-PMH ListRecords or ListIdentifiers response, given as verb,
+	of the repository at url, in part files PREFIX-00000.xml, ... All but
+	the last end with a resumptionToken naming the next part, so a static
+	server can answer the token with the part of that name.
+	"""
+	def __init__(self, verb, url, date, prefix, size=0, count=0):
+		PartWriter.__init__(self, None, prefix=prefix, ext='xml', size=size, count=count)
+		self.verb = verb
+		self.url = escape(url)
+		self.date = date
+		self.tail = self.closing(False)
+
+	def opening(self):
+		if self.parts:
+			request = 'resumptionToken="{0}"'.format(escape(basename(self.name(self.parts))))
+		else:
+			request = 'metadataPrefix="oai_dc"'
+		return OAI_HEAD.format(self.date, self.verb, request, self.url) + '<{0}>\n'.format(self.verb)
+
+	def closing(self, last):
+		if not last:
+			token = '<resumptionToken cursor="{0}">{1}</resumptionToken>\n'.format(self.total,
+				escape(basename(self.name(self.parts))))
+		elif self.parts > 1:
+			token = '<resumptionToken cursor="{0}" completeListSize="{1}"/>\n'.format(self.total,
+				self.total + self.records)
+		else:
+			token = ''
+		return '{0}</{1}>\n</OAI-PMH>\n'.format(token, self.verb)
+
+	def close(self):
+		if self.parts:
+			PartWriter.close(self)
+		else:
+			# an empty list is an error in OAI-PMH
+			self.fp = open(self.name(0) + '.xml', 'wb')
+			self.fp.write(OAI_HEAD.format(self.date, self.verb, 'metadataPrefix="oai_dc"', self.url))
+			self.fp.write('<error code="noRecordsMatch"/>\n</OAI-PMH>\n')
+			self.fp.close()
+
+class OaiSink(object):
+	"""
+	Writes every record with an identifier into the pages of an OAI-PMH
+	ListRecords response, its DC elements as oai_dc, and its header into
+	the pages of the matching ListIdentifiers response, PREFIX-00000.xml,
+	... and PREFIX-identifiers-00000.xml, ... Records are identified as
+	oai:HOST:IDENTIFIER, HOST being the host of the repository url.
+	"""
+	records = True
+
+	def __init__(self, prefix, url, size=0, count=OAI_PAGE):
+		date = strftime('%Y-%m-%dT%H:%M:%SZ', gmtime())
+		self.datestamp = date[:10]
+		self.host = urlsplit(url).hostname or ''
+		self.listrecords = OaiPages('ListRecords', url, date, prefix, size, count)
+		self.listidentifiers = OaiPages('ListIdentifiers', url, date, prefix + '-identifiers', size, count)
+		self.skipped = 0
+
+	def add(self, identifier, record, macrepo):
+		if not identifier:
+			self.skipped += 1
+			return
+		header = OAI_HEADER.format(escape('oai:{0}:{1}'.format(self.host, quote(identifier, OAI_SAFE))),
+			self.datestamp)
+		self.listrecords.write('<record>\n{0}<metadata>\n{1}{2}</oai_dc:dc>\n</metadata>\n</record>\n'.format(
+			header, OAI_DC_HEAD, record.xmlElements(empty=False)))
+		self.listidentifiers.write(header)
+
+	def close(self):
+		self.listrecords.close()
+		self.listidentifiers.close()
+		if self.skipped:
+			print >> sys.stderr, "Warning: {0} records without dc:identifier were left out of the OAI-PMH pages".format(
+				self.skipped)
+
+# encodes one value as JSON, ASCII only
+encodejson = json.JSONEncoder().encode
+# (attribute, key) of every Dublin Core element of a JSON document
+JSON_KEYS = tuple((attribute, encodejson('dc:' + tag) + ': ') for attribute, tag in ELEMENTS)
+
+def jsondocument(identifier, record, macrepo):
+	"""
+	A record as a JSON object: its identifier as "id", then each DC
+	element and each of the macrepo (element, value) pairs that is set
+	under its tag, such as "dc:title" or "macrepo:notes". A split
+	column is an array of its non-empty values, left out if it has none.
+	"""
+	fields = ['"id": ' + encodejson(identifier)] if identifier else []
+	pairs = chain([(key, getattr(record, attribute)) for attribute, key in JSON_KEYS],
+		[(encodejson(element) + ': ', value) for element, value in macrepo])
+	try:
+		for key, value in pairs:
+			if isinstance(value, list):
+				value = [entry for entry in value if entry]
+			if value:
+				fields.append(key + encodejson(value))
+	except UnicodeDecodeError:
+		raise DecodeError('{0}: JSON output needs UTF-8 values, give --encoding'.format(identifier))
+	return '{' + ', '.join(fields) + '}'
+
+# stream sinks selectable with --stdout
+SINKS = {'tar': TarSink, 'xml': XmlSink, 'rdf': RdfSink, 'nt': NTriplesSink, 'ttl': TurtleSink,
+	'json': JsonSink, 'es': BulkSink, 'solr': SolrSink}
+# the --stdout formats which take records, and so can be split with --parts
+RECORD_FORMATS = sorted(name for name, kind in SINKS.items() if getattr(kind, 'records', False))
 
 def chkarg(arg):
 	""" Was a TSV file specified? """
-	return False if len(arg) < 2 else True
+	return False if len(arg) < 1 else True
 
 def usage():
 	""" Print a nice usage message """
-	print "Usage: bin/python " + basename(__file__) + " <filename>.tsv"
+	print "Usage: bin/python " + basename(__file__) + " [options] <filename>.tsv ..."
+
+def options():
+	""" Build the command line option parser """
+	parser = OptionParser(usage="bin/python " + basename(__file__) + " [options] <filename>.tsv|<dir>|<glob> ...")
+	parser.add_option('-w', '--workers', type='int', default=1,
+		help='number of worker processes to convert rows with [default: 1]')
+	parser.add_option('-s', '--stdout', type='choice', choices=sorted(SINKS), metavar='FORMAT',
+		help='write all documents to stdout as a tar stream or as NUL separated xml, or every record into one rdf (RDF/XML), nt (N-Triples) or ttl (Turtle) document, as json lines or for an es (Elasticsearch bulk) or solr update, instead of one file each')
+	parser.add_option('--rdf-base', default='', metavar='URI',
+		help='with --stdout rdf, nt or ttl, the subject of each record is URI followed by its dc:identifier; nt needs an absolute URI')
+	parser.add_option('--parts', metavar='PREFIX',
+		help='with a --stdout format other than tar and xml, write numbered part files PREFIX-00000.EXT, ... instead of stdout')
+	parser.add_option('--part-size', type='int', default=PART_SIZE, metavar='MB',
+		help='with --parts, start a new part rather than take one past MB megabytes [default: %default]')
+	parser.add_option('--part-records', type='int', default=0, metavar='N',
+		help='with --parts, also start a new part after every N records; with --oai, the records on a page [default: %d with --oai]' % OAI_PAGE)
+	parser.add_option('--oai', metavar='PREFIX',
+		help='write OAI-PMH ListRecords pages PREFIX-00000.xml, ... and ListIdentifiers pages PREFIX-identifiers-00000.xml, ... chained by resumption tokens')
+	parser.add_option('--oai-url', metavar='URL',
+		help='base URL of the OAI-PMH repository serving the --oai pages')
+	parser.add_option('--shard', metavar='I/N',
+		help='convert only shard I of N (counting from 1) of every input')
+	parser.add_option('--shard-by', type='choice', choices=['range', 'identifier'], default='range',
+		help='cut shards into contiguous byte ranges or by a hash of dc:identifier [default: range]')
+	parser.add_option('--rows', metavar='A:B',
+		help='convert only data rows A to B-1 (counting from 0) of every input')
+	parser.add_option('--index', action='store_true', default=False,
+		help='also write a FILE.idx row index next to every uncompressed input')
+	parser.add_option('--only', metavar='ID[,ID...]',
+		help='regenerate just these identifiers, using the index written by --index')
+	parser.add_option('-p', '--parser', type='choice', choices=['auto', 'csv', 'split'], default='auto',
+		help='row parser: csv, split (str.split on tabs, for input without quotes) or auto to pick per input [default: auto]')
+	parser.add_option('-e', '--encoding',
+		help='character encoding of the input, e.g. utf-8, latin-1 or cp1252; it is validated and the output written as UTF-8')
+	parser.add_option('-m', '--mapping', metavar='FILE',
+		help='read the column to element mapping from FILE, one tab separated "column element [delimiter [default]]" per line')
+	parser.add_option('-d', '--delimiter', action='append', default=[], metavar='COLUMN=DELIM',
+		help='split COLUMN into one element per value on DELIM, may be repeated')
+	parser.add_option('-i', '--intern', action='store_true', default=False,
+		help='share repeated column values between rows, and report per column')
+	parser.add_option('-b', '--batch', type='int', default=BATCH_SIZE, metavar='N',
+		help='convert blocks of N rows a column at a time, 0 converts row by row [default: %default]')
+	parser.add_option('--escape-cache', type='int', default=ESCAPE_CACHE, metavar='N',
+		help='keep the escaped XML of the N most recently used values of up to 1 KB, 0 turns the cache off [default: %default]')
+	parser.add_option('--macrepo-style', type='choice', choices=sorted(MACREPO_STYLES), default='pretty',
+		help='layout of the macrepo documents: pretty, as minidom used to write them with the running Python (text on its own line before 2.7.3), or compact [default: %default]')
+	parser.add_option('-q', '--quiet', action='store_true', default=False,
+		help='do not print the run summary')
+	return parser
+
+def shardspec(parser, spec):
+	""" Parse an I/N --shard argument into a zero-based (index, count) """
+	if not spec:
+		return None
+	try:
+		index, count = [int(n) for n in spec.split('/')]
+	except ValueError:
+		parser.error('--shard must look like I/N')
+	if not 1 <= index <= count:
+		parser.error('--shard I/N needs 1 <= I <= N')
+	return index - 1, count
+
+def rowslice(parser, spec):
+	""" Parse an A:B --rows argument into (A, B), either may be None """
+	if not spec:
+		return None
+	try:
+		first, last = [int(n) if n else None for n in spec.split(':')]
+	except ValueError:
+		parser.error('--rows must look like A:B')
+	if (first or 0) < 0 or (last is not None and last < (first or 0)):
+		parser.error('--rows A:B needs 0 <= A <= B')
+	return first, last
 
 if __name__ == "__main__":
-	if chkarg(argv):
-		parse(argv[1])
+	# a reader of the output going away, as head does, ends the run quietly
+	signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+	parser = options()
+	opts, args = parser.parse_args()
+	if opts.workers < 1:
+		parser.error('--workers must be at least 1')
+	if opts.batch < 0:
+		parser.error('--batch cannot be negative')
+	if opts.escape_cache < 0:
+		parser.error('--escape-cache cannot be negative')
+	if opts.parts and opts.stdout not in RECORD_FORMATS:
+		parser.error('--parts needs --stdout ' + ', '.join(RECORD_FORMATS))
+	if opts.part_size < 1:
+		parser.error('--part-size must be at least 1')
+	if opts.stdout == 'nt' and not urlsplit(opts.rdf_base).scheme:
+		parser.error('--stdout nt needs an absolute --rdf-base URI, N-Triples subjects must be absolute IRIs')
+	if opts.part_records < 0:
+		parser.error('--part-records cannot be negative')
+	if opts.oai and (opts.stdout or opts.parts):
+		parser.error('--oai cannot be combined with --stdout or --parts')
+	if opts.oai and not opts.oai_url:
+		parser.error('--oai needs --oai-url')
+	files = expand(args)
+	if opts.workers > 1 and (opts.stdout or '-' in files):
+		parser.error('reading stdin or writing to stdout needs --workers 1')
+	if opts.workers > 1 and opts.oai:
+		parser.error('--oai needs --workers 1')
+	select = None
+	if opts.shard or opts.rows:
+		select = Selection(rowslice(parser, opts.rows), shardspec(parser, opts.shard), opts.shard_by)
+	if (opts.index or opts.only) and select:
+		parser.error('--index and --only cannot be combined with --shard or --rows')
+	if opts.encoding:
+		try:
+			utf8 = codecs.lookup(opts.encoding).name == 'utf-8'
+		except LookupError:
+			parser.error('unknown encoding: ' + opts.encoding)
+		if (opts.index or opts.only) and not utf8:
+			parser.error('--index and --only need UTF-8 input')
+	mapping = MAPPING
+	try:
+		if opts.mapping:
+			mapping = loadmapping(opts.mapping)
+		mapping = setdelimiters(mapping, opts.delimiter)
+	except (IOError, ValueError) as e:
+		parser.error(str(e))
+	if chkarg(files):
+		if opts.oai:
+			sink = OaiSink(opts.oai, opts.oai_url, opts.part_size << 20, opts.part_records or OAI_PAGE)
+		elif opts.stdout in RECORD_FORMATS:
+			sink = SINKS[opts.stdout](sys.stdout, opts.rdf_base, opts.parts, opts.part_size << 20,
+				opts.part_records)
+		else:
+			sink = SINKS[opts.stdout](sys.stdout) if opts.stdout else None
+		if opts.only:
+			regenerate(files, opts.only.split(','), opts.quiet, sink, opts.encoding, mapping,
+				opts.macrepo_style)
+		else:
+			batch(files, opts.workers, opts.quiet, sink, select, opts.index, opts.parser, opts.encoding,
+				mapping, opts.intern, opts.batch, opts.escape_cache, opts.macrepo_style)
+		if sink:
+			sink.close()
 	else:
 		usage()
 